@@ -14,7 +14,7 @@ setuptools.setup(
     install_requires=[
         'imageio>=2.3',
         'numpy>=1.14',
-        'numba>=0.39',
+        'numba>=0.49',
         'scipy>=0.16',
     ],
     url="https://github.com/prideout/snowy",
@@ -15,8 +15,8 @@ from .color import *
 from .draw import *
 
 __all__ = '''
-GAUSSIAN HERMITE LANCZOS MITCHELL NEAREST TRIANGLE
-blur resize
+FAST_GAUSSIAN GAUSSIAN HERMITE LANCZOS MITCHELL NEAREST TRIANGLE
+blur generate_mipmaps resize
 
 LINEAR SRGB GAMMA
 delinearize
@@ -35,6 +35,7 @@ ColorSpace
 
 add_border
 compose
+compose_many
 compose_premultiplied
 gradient
 hflip
@@ -45,15 +46,25 @@ vflip
 vstack
 
 generate_gdf
+generate_gdf_volume
 generate_sdf
+generate_sdf_streamed
+generate_sdf_volume
 generate_udf
+generate_udf_streamed
+generate_udf_volume
+update_sdf
 generate_cpcf
+generate_voronoi
 dereference_coords
 
 generate_noise
 generate_fBm
 
 compute_skylight
+compute_skylight_progressive
+compute_skylight_tiled
+generate_max_pyramid
 compute_normals
 
 rgb_to_luminance
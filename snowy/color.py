@@ -12,7 +12,7 @@ def compute_sobel(image: np.ndarray):
     "Apply Sobel operator for edge detection."
     assert len(image.shape) == 3, 'Shape is not rows x cols x channels'
     assert image.shape[2] == 1, 'Image must be grayscale'
-    result = np.empty(image.shape)
+    result = np.empty(image.shape, dtype=io._float_dtype(image))
     _compute_sobel(result, image)
     return result
 
@@ -6,31 +6,147 @@ Distance fields are useful in a variety of applications, including
 image segmentation, antialiasing algorithms, and texture synthesis.
 """
 
-from numba import jit
+from numba import jit, prange
+import numba
 import numpy as np
 from . import io
 
 INF = 1e20
+_BAND_TILE = 64
 
-def generate_sdf(image: np.ndarray, wrapx=False, wrapy=False):
-    """Create a signed distance field from a boolean field."""
-    a = generate_udf(image, wrapx, wrapy)
-    b = generate_udf(image == 0.0, wrapx, wrapy)
-    return a - b
+def generate_sdf(image: np.ndarray, wrapx=False, wrapy=False,
+                 max_distance=None, dtype=np.float64, spacing=None):
+    """Create a signed distance field from a boolean field.
+
+    Distances are positive outside the shape and negative inside it.
+    If max_distance is given, distances are clamped to that band, and
+    tiles that are far from the boundary are skipped entirely. The
+    result can be float64, float32, or quantized to uint8 / uint16, in
+    which case max_distance is required and the band is mapped to the
+    full integer range.
 
-def generate_udf(image: np.ndarray, wrapx=False, wrapy=False):
-    """Create an unsigned distance field from a boolean field."""
+    The optional spacing is the (x, y) size of a pixel. For geographic
+    rasters, x can also be a sequence with one spacing per row.
+    """
+    assert image.dtype == 'bool', 'Pixel values must be boolean'
+    assert len(image.shape) == 3, 'Shape is not rows x cols x channels'
+    assert image.shape[2] == 1, 'Image must be grayscale'
+    dtype = np.dtype(dtype)
+    assert dtype in (np.float32, np.float64, np.uint8, np.uint16), \
+        'Distances must be float32, float64, uint8, or uint16'
+    if dtype.kind == 'u':
+        assert max_distance, 'Quantized distances require max_distance'
+    spacing = _pixel_spacing(spacing, image.shape[0])
+    if max_distance is not None:
+        return _generate_banded(image, wrapx, wrapy, max_distance, True,
+                                dtype, spacing)
+    return _generate_sdf(image, wrapx, wrapy, max_distance, dtype, spacing)
+
+def generate_udf(image: np.ndarray, wrapx=False, wrapy=False,
+                 max_distance=None, spacing=None):
+    """Create an unsigned distance field from a boolean field.
+
+    If max_distance is given, distances are clamped to that band, and
+    tiles that are far from every set pixel are skipped entirely. See
+    <a href="#generate_sdf">generate_sdf</a> for spacing.
+    """
     assert image.dtype == 'bool', 'Pixel values must be boolean'
     assert len(image.shape) == 3, 'Shape is not rows x cols x channels'
     assert image.shape[2] == 1, 'Image must be grayscale'
-    return _generate_edt(image, wrapx, wrapy)
+    spacing = _pixel_spacing(spacing, image.shape[0])
+    if max_distance is not None:
+        return _generate_banded(image, wrapx, wrapy, max_distance, False,
+                                np.dtype(np.float64), spacing)
+    return _generate_edt(image, wrapx, wrapy, spacing)
+
+def update_sdf(sdf: np.ndarray, image: np.ndarray, bounds,
+               max_distance=None, out=None):
+    """Update a signed distance field after its boolean field changed.
+
+    The sdf must have been created from the previous boolean field
+    without wrapping or spacing, and image is the new boolean field.
+    The changed pixels must lie within bounds, given as (left, top,
+    right, bottom) with exclusive right and bottom. Only the pixels that
+    the change can reach are recomputed. The result is written into
+    <code>out</code> when it is provided, which can be the sdf itself.
+    """
+    assert image.dtype == 'bool', 'Pixel values must be boolean'
+    assert len(image.shape) == 3, 'Shape is not rows x cols x channels'
+    assert image.shape[2] == 1, 'Image must be grayscale'
+    assert sdf.shape == image.shape, 'Shapes do not match'
+    assert sdf.dtype in (np.float32, np.float64), 'Distances must be floats'
+    result = io._prepare_out(out, sdf.shape, sdf.dtype)
+    if result is not sdf:
+        np.copyto(result, sdf)
+    _update_sdf(io.unshape(result), io.unshape(image), bounds, max_distance)
+    return result
+
+def generate_sdf_streamed(source, out, wrapx=False, wrapy=False,
+                          strip_size=None, max_memory=2**29):
+    """Create a signed distance field from a boolean field in strips.
+
+    This is meant for fields that do not fit in memory. The source can
+    be an np.memmap or any other array-like that supports slicing, or a
+    callable that takes (top, bottom, left, right) and returns that
+    block of the field. The result is written into out, which is
+    typically an np.memmap with a float32 or float64 channel.
 
-def generate_gdf(image: np.ndarray, wrapx=False, wrapy=False):
-    "Create an generalized squared distance field from a scalar field."
+    The field is processed in strips of columns, then in strips of
+    rows. By default the strips are as large as max_memory bytes
+    allows, which keeps the number of passes over the files small.
+    Pass strip_size to use a fixed number of columns and rows instead.
+    """
+    return _generate_streamed(source, out, True, wrapx, wrapy, strip_size,
+                              max_memory)
+
+def generate_udf_streamed(source, out, wrapx=False, wrapy=False,
+                          strip_size=None, max_memory=2**29):
+    """Create an unsigned distance field from a boolean field in strips.
+
+    See also <a href="#generate_sdf_streamed">generate_sdf_streamed</a>.
+    """
+    return _generate_streamed(source, out, False, wrapx, wrapy, strip_size,
+                              max_memory)
+
+def generate_gdf(image: np.ndarray, wrapx=False, wrapy=False,
+                 spacing=None):
+    """Create an generalized squared distance field from a scalar field.
+
+    See <a href="#generate_sdf">generate_sdf</a> for spacing.
+    """
     assert image.dtype == 'float64', 'Pixel values must be real'
     assert len(image.shape) == 3, 'Shape is not rows x cols x channels'
     assert image.shape[2] == 1, 'Image must be grayscale'
-    return _generate_gdt(image, wrapx, wrapy)
+    spacing = _pixel_spacing(spacing, image.shape[0])
+    return _generate_gdt(image, wrapx, wrapy, spacing)
+
+def generate_sdf_volume(volume: np.ndarray, wrapx=False, wrapy=False,
+                        wrapz=False):
+    """Create a signed distance field from a boolean volume.
+
+    Volumes are arrays of slices x rows x cols, without a channel.
+    """
+    a = generate_udf_volume(volume, wrapx, wrapy, wrapz)
+    b = generate_udf_volume(volume == 0, wrapx, wrapy, wrapz)
+    return a - b
+
+def generate_udf_volume(volume: np.ndarray, wrapx=False, wrapy=False,
+                        wrapz=False):
+    """Create an unsigned distance field from a boolean volume."""
+    assert volume.dtype == 'bool', 'Voxel values must be boolean'
+    assert len(volume.shape) == 3, 'Shape is not slices x rows x cols'
+    result = np.where(volume, 0.0, INF)
+    _generate_vdt(result, wrapx, wrapy, wrapz)
+    return np.sqrt(result)
+
+def generate_gdf_volume(volume: np.ndarray, wrapx=False, wrapy=False,
+                        wrapz=False):
+    "Create a generalized squared distance field from a scalar volume."
+    assert volume.dtype == 'float64', 'Voxel values must be real'
+    assert len(volume.shape) == 3, 'Shape is not slices x rows x cols'
+    result = volume.copy()
+    _generate_vdt(result, wrapx, wrapy, wrapz)
+    return result
 
 def generate_cpcf(image: np.ndarray):
     """Create closest point coordinate field from a boolean field."""
@@ -39,6 +155,26 @@ def generate_cpcf(image: np.ndarray):
     assert image.shape[2] == 1, 'Image must be grayscale'
     return _generate_cpcf(image)
 
+def generate_voronoi(image: np.ndarray, source: np.ndarray, wrapx=False,
+                     wrapy=False):
+    """Color each pixel with the source color at its closest seed.
+
+    The seeds are the set pixels in the given boolean field. This is
+    equivalent to dereferencing the closest point coordinate field, but
+    never builds it.
+    """
+    assert image.dtype == 'bool', 'Pixel values must be boolean'
+    assert len(image.shape) == 3, 'Shape is not rows x cols x channels'
+    assert image.shape[2] == 1, 'Image must be grayscale'
+    assert len(source.shape) == 3, 'Shape is not rows x cols x channels'
+    assert source.shape[:2] == image.shape[:2], 'Shapes do not match'
+    image = io.unshape(image)
+    result = np.where(image, 0.0, INF)
+    i, j = _generate_udf(result, wrapx, wrapy, indices=True)
+    voronoi = np.empty_like(source)
+    _generate_voronoi(voronoi, source, i, j)
+    return voronoi
+
 def dereference_coords(source: np.ndarray, coords: np.ndarray):
     """
     For each 2D value in the coord field, make a lookup in the source.
@@ -47,87 +183,474 @@ def dereference_coords(source: np.ndarray, coords: np.ndarray):
     assert len(coords.shape) == 3, 'Shape is not rows x cols x channels'
     assert len(source.shape) == 3, 'Shape is not rows x cols x channels'
     assert coords.shape[2] == 2, 'Coordinate must be 2-tuples'
-    voronoi = source.copy()
-    height, width = source.shape[:2]
-    coords = coords.copy()
-    coords[:,:,0] = np.clip(coords[:,:,0], 0, width - 1)
-    coords[:,:,1] = np.clip(coords[:,:,1], 0, height - 1)
+    if coords.shape[:2] == source.shape[:2]:
+        voronoi = np.empty_like(source)
+    else:
+        voronoi = source.copy()
     _deref_coords(voronoi, source, coords)
     return voronoi
 
-@jit(nopython=True, fastmath=True, cache=True)
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
 def _deref_coords(voronoi, source, coords):
-    for y in range(coords.shape[0]):
+    # Coordinates are clamped to the source as they are read.
+    height, width = source.shape[:2]
+    for y in prange(coords.shape[0]):
         for x in range(coords.shape[1]):
-            i, j = coords[y][x]
-            voronoi[y][x] = source[j][i]
+            i = min(max(coords[y,x,0], 0), width - 1)
+            j = min(max(coords[y,x,1], 0), height - 1)
+            voronoi[y,x] = source[j,i]
 
-def _generate_gdt(image, wrapx, wrapy):
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _generate_voronoi(voronoi, source, i, j):
+    # The row pass found the column of the closest point, and the column
+    # pass found the closest row within that column.
+    for y in prange(voronoi.shape[0]):
+        for x in range(voronoi.shape[1]):
+            col = i[y,x]
+            voronoi[y,x] = source[j[y,col],col]
+
+def _pixel_spacing(spacing, height):
+    # Return the horizontal spacing of each row and the vertical spacing.
+    sx, sy = (1.0, 1.0) if spacing is None else spacing
+    sx = np.broadcast_to(np.asarray(sx, dtype=np.float64), (height,))
+    return sx, float(sy)
+
+def _generate_gdt(image, wrapx, wrapy, spacing):
     image = io.unshape(image)
     result = image.copy()
-    _generate_udf(result, wrapx, wrapy)
+    _generate_udf(result, wrapx, wrapy, spacing=spacing)
+    return io.reshape(result)
+
+def _generate_banded(image, wrapx, wrapy, max_distance, signed, dtype,
+                     spacing):
+    # Only tiles that have a seed pixel within max_distance need exact
+    # distances. Seeds are the set pixels for an unsigned field, or the
+    # pixels along the boundary for a signed field. Each active tile is
+    # transformed together with a margin of max_distance, which is
+    # enough to see its nearest seed whenever that seed is in the band.
+    # The margin is measured in pixels along the narrowest spacing.
+    image = io.unshape(image)
+    height, width = image.shape
+    sx, sy = spacing
+    margin = int(np.ceil(max_distance / min(np.amin(sx), sy)))
+    tile = max(_BAND_TILE, -(-2 * margin // 8) * 8)
+    seeds = _find_edges(image, wrapx, wrapy) if signed else image
+
+    # Seeds are first gathered into small cells, which are dilated by
+    # the band (plus one cell of slack for partial cells at the seams)
+    # and then gathered into tiles.
+    cell = tile // 8
+    cells = _find_tiles(seeds, cell)
+    radius = -(-(margin + 1) // cell) + 1
+    cells = _dilate_tiles(cells, radius, wrapx, wrapy)
+    active = _find_tiles(cells, 8)
+    window = (tile + 2 * margin) ** 2
+    if np.count_nonzero(active) * window >= height * width:
+        field = _generate_band(image, wrapx, wrapy, max_distance, signed,
+                               dtype, spacing)
+        return io.reshape(field)
+    if not signed:
+        inside = outside = max_distance
+    elif dtype.kind == 'u':
+        inside, outside = 0, np.iinfo(dtype).max
+    else:
+        inside, outside = -max_distance, max_distance
+    result = np.empty(image.shape, dtype=dtype)
+    for ty, tx in np.ndindex(active.shape):
+        y0, x0 = ty * tile, tx * tile
+        y1, x1 = min(y0 + tile, height), min(x0 + tile, width)
+        if not active[ty, tx]:
+            result[y0:y1,x0:x1] = inside if image[y0, x0] else outside
+            continue
+        rows, oy = _band_window(height, y0, y1, margin, wrapy)
+        cols, ox = _band_window(width, x0, x1, margin, wrapx)
+        field = _generate_band(image[np.ix_(rows, cols)], False, False,
+                               max_distance, signed, dtype, (sx[rows], sy))
+        result[y0:y1,x0:x1] = field[oy:oy + y1 - y0, ox:ox + x1 - x0]
+    return io.reshape(result)
+
+def _update_sdf(field, image, bounds, max_distance):
+    # A pixel can only be affected if its distance to the changed pixels
+    # is within its old distance to the boundary. Otherwise, neither its
+    # old closest pixel nor any new pixel can be its closest pixel.
+    height, width = field.shape
+    x0, y0, x1, y1 = bounds
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, width), min(y1, height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    lo, hi = _find_affected(field, x0, y0, x1, y1)
+    rows = np.nonzero(hi >= 0)[0]
+    y0, y1 = rows[0], rows[-1] + 1
+    x0, x1 = np.amin(lo[y0:y1]), np.amax(hi[y0:y1]) + 1
+
+    # The affected region is transformed together with a margin, which
+    # is doubled until every affected distance is provably shorter than
+    # the distance to any pixel outside the margin. The old distances
+    # are usually a good first guess.
+    spacing = _pixel_spacing(None, height)
+    if max_distance:
+        margin = int(np.ceil(max_distance))
+    else:
+        reach = np.amax(np.abs(field[y0:y1,x0:x1]))
+        margin = int(min(np.ceil(reach), max(width, height)))
+    margin = max(margin, 1)
+    while True:
+        wy0, wy1 = max(y0 - margin, 0), min(y1 + margin, height)
+        wx0, wx1 = max(x0 - margin, 0), min(x1 + margin, width)
+        window = image[wy0:wy1,wx0:wx1]
+        sdf = _generate_sdf(window, False, False, max_distance, field.dtype,
+                            spacing)
+        sdf = io.unshape(sdf)[y0 - wy0:y1 - wy0,x0 - wx0:x1 - wx0]
+        reach = np.full(sdf.shape, np.inf)
+        y, x = np.ogrid[y0:y1,x0:x1]
+        if wy0 > 0: reach = np.minimum(reach, y - wy0 + 1)
+        if wx0 > 0: reach = np.minimum(reach, x - wx0 + 1)
+        if wy1 < height: reach = np.minimum(reach, wy1 - y)
+        if wx1 < width: reach = np.minimum(reach, wx1 - x)
+        whole = wy1 - wy0 == height and wx1 - wx0 == width
+        if whole or np.all(np.abs(sdf) <= reach):
+            break
+        margin *= 2
+    field[y0:y1,x0:x1] = sdf
+
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _find_affected(field, x0, y0, x1, y1):
+    # Find the horizontal extent of the affected pixels in each row.
+    height, width = field.shape
+    lo = np.full(height, width)
+    hi = np.full(height, -1)
+    for y in prange(height):
+        dy = max(y0 - y, 0, y - y1 + 1)
+        for x in range(width):
+            dx = max(x0 - x, 0, x - x1 + 1)
+            if np.sqrt(dx * dx + dy * dy) <= abs(field[y,x]) + 0.001:
+                lo[y] = min(lo[y], x)
+                hi[y] = x
+    return lo, hi
+
+def _generate_band(image, wrapx, wrapy, max_distance, signed, dtype,
+                   spacing):
+    if signed:
+        field = _generate_sdf(image, wrapx, wrapy, max_distance, dtype,
+                              spacing)
+        return io.unshape(field)
+    field = _generate_edt(image, wrapx, wrapy, spacing)
+    return np.minimum(io.unshape(field), max_distance)
+
+def _band_window(n, start, stop, margin, wrap):
+    # Return the indices of a tile extended by the given margin, along
+    # with the offset of the tile within them.
+    if wrap:
+        return np.arange(start - margin, stop + margin) % n, margin
+    lo, hi = max(start - margin, 0), min(stop + margin, n)
+    return np.arange(lo, hi), start - lo
+
+def _find_edges(image, wrapx, wrapy):
+    edges = np.zeros(image.shape, dtype=bool)
+    if wrapx:
+        edges |= image != np.roll(image, 1, axis=1)
+    else:
+        edges[:,1:] |= image[:,1:] != image[:,:-1]
+    if wrapy:
+        edges |= image != np.roll(image, 1, axis=0)
+    else:
+        edges[1:,:] |= image[1:,:] != image[:-1,:]
+    return edges
+
+def _find_tiles(seeds, tile):
+    height, width = seeds.shape
+    rows = np.logical_or.reduceat(seeds, np.arange(0, height, tile), axis=0)
+    return np.logical_or.reduceat(rows, np.arange(0, width, tile), axis=1)
+
+def _dilate_tiles(tiles, radius, wrapx, wrapy):
+    for axis, wrap in ((0, wrapy), (1, wrapx)):
+        n = tiles.shape[axis]
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (radius, radius)
+        padded = np.pad(tiles, pad, mode='wrap' if wrap else 'constant')
+        tiles = np.zeros_like(tiles)
+        for shift in range(2 * radius + 1):
+            tiles |= np.take(padded, range(shift, shift + n), axis=axis)
+    return tiles
+
+def _generate_sdf(image, wrapx, wrapy, max_distance, dtype, spacing):
+    image = io.unshape(image)
+    height, width = image.shape
+    outside = np.empty(image.shape, dtype=np.float32)
+    inside = np.empty(image.shape, dtype=np.float32)
+    result = np.empty(image.shape, dtype=dtype)
+    limit = INF if max_distance is None else float(max_distance)
+    scale = float(np.iinfo(dtype).max) if dtype.kind == 'u' else 0.0
+    sx, sy = spacing
+    nchunks = numba.get_num_threads()
+    _generate_sdf_native(width, height, image, outside, inside, result,
+                         wrapx, wrapy, sx, sy, limit, scale, nchunks)
     return io.reshape(result)
 
-def _generate_edt(image, wrapx, wrapy):
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _generate_sdf_native(width, height, image, outside, inside, result,
+                         wrapx, wrapy, sx, sy, limit, scale, nchunks):
+    # The distances to the nearest set pixel and to the nearest unset
+    # pixel are found together, sharing one set of scratch buffers per
+    # thread. After the column pass, each field holds the vertical
+    # distance to the nearest feature in pixels, which is an integer and
+    # can therefore be stored exactly in single precision. The row pass
+    # applies the pixel spacing, combines both fields and writes the
+    # final value.
+    capacity = 3 * max(width, height)
+    for chunk in prange(nchunks):
+        f, d = np.empty(capacity), np.empty(capacity)
+        z, v = np.empty(capacity + 1), np.empty(capacity, np.int64)
+        k = np.empty(capacity, np.int64)
+        for x in range(chunk * width // nchunks,
+                       (chunk + 1) * width // nchunks):
+            for q in range(height):
+                f[q] = 0.0 if image[q,x] else INF
+            _edt_wrapped(f, d, z, v, k, height, wrapy, 1.0)
+            for q in range(height):
+                outside[q,x] = np.sqrt(d[q])
+            for q in range(height):
+                f[q] = INF if image[q,x] else 0.0
+            _edt_wrapped(f, d, z, v, k, height, wrapy, 1.0)
+            for q in range(height):
+                inside[q,x] = np.sqrt(d[q])
+    for chunk in prange(nchunks):
+        f, d = np.empty(capacity), np.empty(capacity)
+        z, v = np.empty(capacity + 1), np.empty(capacity, np.int64)
+        k = np.empty(capacity, np.int64)
+        a = np.empty(width)
+        for y in range(chunk * height // nchunks,
+                       (chunk + 1) * height // nchunks):
+            sx2 = sx[y] * sx[y]
+            for q in range(width):
+                f[q] = sy * sy * np.float64(outside[y,q]) ** 2
+            _edt_wrapped(f, d, z, v, k, width, wrapx, sx2)
+            for q in range(width):
+                a[q] = np.sqrt(d[q])
+            for q in range(width):
+                f[q] = sy * sy * np.float64(inside[y,q]) ** 2
+            _edt_wrapped(f, d, z, v, k, width, wrapx, sx2)
+            for q in range(width):
+                s = min(max(a[q] - np.sqrt(d[q]), -limit), limit)
+                if scale:
+                    s = np.floor((s + limit) * scale / (2.0 * limit) + 0.5)
+                result[y,q] = s
+
+def _generate_streamed(source, out, signed, wrapx, wrapy, strip_size,
+                       max_memory):
+    # The column pass writes vertical distances into the output, one
+    # strip of columns at a time, and the row pass then reads them back
+    # one strip of rows at a time. For signed fields, set pixels store
+    # their vertical distance to the nearest unset pixel as a negative
+    # number, so a single intermediate field is enough. Files are
+    # stored row by row, so a strip of columns touches every page of
+    # both files, which is why the strips default to being as wide as
+    # the memory budget allows.
+    if not callable(source):
+        assert len(source.shape) == 3, 'Shape is not rows x cols x channels'
+        assert source.shape[2] == 1, 'Image must be grayscale'
+        assert out.shape == source.shape, 'Output has the wrong shape'
+    assert len(out.shape) == 3 and out.shape[2] == 1, 'Out must be grayscale'
+    assert out.dtype in (np.float32, np.float64), 'Output must be floats'
+    height, width = out.shape[:2]
+    if strip_size is None:
+        ncols = max_memory // (height * (1 + out.dtype.itemsize))
+        nrows = max_memory // (width * 8)
+    else:
+        ncols = nrows = strip_size
+    ncols = int(min(max(ncols, 1), width))
+    nrows = int(min(max(nrows, 1), height))
+    nchunks = numba.get_num_threads()
+    strip = np.empty((height, ncols), out.dtype)
+    for x0 in range(0, width, ncols):
+        x1 = min(x0 + ncols, width)
+        block = _read_block(source, 0, height, x0, x1)
+        result = strip[:,:x1 - x0]
+        _stream_columns(block, result, signed, wrapy, nchunks)
+        out[:,x0:x1,0] = result
+    for y0 in range(0, height, nrows):
+        y1 = min(y0 + nrows, height)
+        block = np.array(out[y0:y1,:,0], dtype=np.float64)
+        _stream_rows(block, signed, wrapx, nchunks)
+        out[y0:y1,:,0] = block
+    return out
+
+def _read_block(source, y0, y1, x0, x1):
+    if callable(source):
+        block = source(y0, y1, x0, x1)
+    else:
+        block = source[y0:y1,x0:x1]
+    return np.asarray(block, dtype=bool).reshape(y1 - y0, x1 - x0)
+
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _stream_columns(block, result, signed, wrap, nchunks):
+    height, width = block.shape
+    capacity = 3 * height
+    for chunk in prange(nchunks):
+        f, d = np.empty(capacity), np.empty(capacity)
+        z, v = np.empty(capacity + 1), np.empty(capacity, np.int64)
+        k = np.empty(capacity, np.int64)
+        for x in range(chunk * width // nchunks,
+                       (chunk + 1) * width // nchunks):
+            for q in range(height):
+                f[q] = 0.0 if block[q,x] else INF
+            _edt_wrapped(f, d, z, v, k, height, wrap, 1.0)
+            for q in range(height):
+                result[q,x] = np.sqrt(d[q])
+            if not signed:
+                continue
+            for q in range(height):
+                f[q] = INF if block[q,x] else 0.0
+            _edt_wrapped(f, d, z, v, k, height, wrap, 1.0)
+            for q in range(height):
+                if block[q,x]:
+                    result[q,x] = -np.sqrt(d[q])
+
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _stream_rows(block, signed, wrap, nchunks):
+    height, width = block.shape
+    capacity = 3 * width
+    for chunk in prange(nchunks):
+        f, d = np.empty(capacity), np.empty(capacity)
+        z, v = np.empty(capacity + 1), np.empty(capacity, np.int64)
+        k = np.empty(capacity, np.int64)
+        a = np.empty(width)
+        for y in range(chunk * height // nchunks,
+                       (chunk + 1) * height // nchunks):
+            for q in range(width):
+                g = block[y,q]
+                f[q] = g * g if g > 0.0 else 0.0
+            _edt_wrapped(f, d, z, v, k, width, wrap, 1.0)
+            for q in range(width):
+                a[q] = np.sqrt(d[q])
+            if signed:
+                for q in range(width):
+                    g = block[y,q]
+                    f[q] = g * g if g < 0.0 else 0.0
+                _edt_wrapped(f, d, z, v, k, width, wrap, 1.0)
+                for q in range(width):
+                    a[q] -= np.sqrt(d[q])
+            block[y,:] = a
+
+def _generate_edt(image, wrapx, wrapy, spacing):
     image = io.unshape(image)
     result = np.where(image, 0.0, INF)
-    _generate_udf(result, wrapx, wrapy)
+    _generate_udf(result, wrapx, wrapy, spacing=spacing)
     return np.sqrt(io.reshape(result))
 
 def _generate_cpcf(image):
     image = io.unshape(image)
     result = np.where(image, 0.0, INF)
-    i, j = _generate_udf(result, False, False)
-    cpcf = np.dstack([i, j])
-    result = cpcf.copy()
-    _process_cpcf(cpcf, result)
-    np.copyto(cpcf, result)
+    i, j = _generate_udf(result, False, False, indices=True)
+    cpcf = np.empty(i.shape + (2,), dtype=i.dtype)
+    _process_cpcf(cpcf, i, j)
     return cpcf
 
-@jit(nopython=True, fastmath=True, cache=True)
-def _process_cpcf(cpcf, result):
-    for y in range(cpcf.shape[0]):
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _process_cpcf(cpcf, i, j):
+    for y in prange(cpcf.shape[0]):
         for x in range(cpcf.shape[1]):
-            i, j = cpcf[y][x]
-            result[y][x][0] = i
-            result[y][x][1] = cpcf[y][i][1]
+            col = i[y,x]
+            cpcf[y,x,0] = col
+            cpcf[y,x,1] = j[y,col]
 
-def _generate_udf(result, wrapx, wrapy):
+def _generate_udf(result, wrapx, wrapy, indices=False, spacing=None):
+    # Closest-point indices are only tracked when asked for. They are
+    # 16 bits wide unless a dimension is too large to be indexed that
+    # way.
+    height, width = result.shape
+    sx, sy = _pixel_spacing(spacing, height)
+    dtype = 'u2' if max(width, height) <= 65536 else 'i4'
+    shape = result.shape if indices else (0, 0)
+    i = np.empty(shape, dtype=dtype)
+    j = np.empty(shape, dtype=dtype)
+    nchunks = numba.get_num_threads()
+    _generate_udf_native(width, height, i, j, result, wrapx, wrapy,
+                         sx, sy, indices, nchunks)
+    if indices:
+        return i, j
 
-    scratch = result
-    if wrapx: scratch = np.hstack([scratch, scratch, scratch])
-    if wrapy: scratch = np.vstack([scratch, scratch, scratch])
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _generate_udf_native(width, height, i, j, result, wrapx, wrapy,
+                         sx, sy, indices, nchunks):
+    # Every column (and then every row) is independent, so they are
+    # split into one contiguous chunk per thread. Each chunk allocates
+    # its own scratch buffers, which are large enough for a wrapped
+    # scanline.
+    capacity = 3 * max(width, height)
+    for chunk in prange(nchunks):
+        f, d = np.empty(capacity), np.empty(capacity)
+        z, v = np.empty(capacity + 1), np.empty(capacity, np.int64)
+        k = np.empty(capacity, np.int64)
+        for x in range(chunk * width // nchunks,
+                       (chunk + 1) * width // nchunks):
+            _edt_scanline(result[:,x], wrapy, f, d, z, v, k, sy * sy)
+            if indices:
+                j[:,x] = k[:height]
+    for chunk in prange(nchunks):
+        f, d = np.empty(capacity), np.empty(capacity)
+        z, v = np.empty(capacity + 1), np.empty(capacity, np.int64)
+        k = np.empty(capacity, np.int64)
+        for y in range(chunk * height // nchunks,
+                       (chunk + 1) * height // nchunks):
+            sx2 = sx[y] * sx[y]
+            _edt_scanline(result[y,:], wrapx, f, d, z, v, k, sx2)
+            if indices:
+                i[y,:] = k[:width]
 
-    height, width = scratch.shape
-    capacity = max(width, height)
-    i = np.empty(scratch.shape, dtype='u2')
-    j = np.empty(scratch.shape, dtype='u2')
-    d = np.zeros([capacity])
-    z = np.zeros([capacity + 1])
-    v = np.zeros([capacity], dtype='u2')
-    _generate_udf_native(width, height, d, z, v, i, j, scratch)
+def _generate_vdt(result, wrapx, wrapy, wrapz):
+    # The transform is separable, so it runs along each axis in turn.
+    # Moving that axis to the end gives a view whose innermost dimension
+    # holds the scanlines.
+    nchunks = numba.get_num_threads()
+    for axis, wrap in ((0, wrapz), (1, wrapy), (2, wrapx)):
+        lines = np.moveaxis(result, axis, -1)
+        _generate_vdt_native(lines, wrap, nchunks)
 
-    x0, x1 = width // 3, 2 * width // 3
-    y0, y1 = height // 3, 2 * height // 3
-    if wrapx: scratch = scratch[:,x0:x1]
-    if wrapy: scratch = scratch[y0:y1,:]
-    if wrapx or wrapy: np.copyto(result, scratch)
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _generate_vdt_native(lines, wrap, nchunks):
+    rows, cols, n = lines.shape
+    count = rows * cols
+    capacity = 3 * n
+    for chunk in prange(nchunks):
+        f, d = np.empty(capacity), np.empty(capacity)
+        z, v = np.empty(capacity + 1), np.empty(capacity, np.int64)
+        k = np.empty(capacity, np.int64)
+        for index in range(chunk * count // nchunks,
+                           (chunk + 1) * count // nchunks):
+            line = lines[index // cols, index % cols]
+            _edt_scanline(line, wrap, f, d, z, v, k, 1.0)
 
-    return i, j
+@jit(nopython=True, fastmath=True, cache=True)
+def _edt_scanline(line, wrap, f, d, z, v, k, s2):
+    # Transform a single scanline in place, using the given scratch
+    # buffers. The closest-point indices are left in k.
+    n = len(line)
+    f[:n] = line
+    _edt_wrapped(f, d, z, v, k, n, wrap, s2)
+    line[:] = d[:n]
 
 @jit(nopython=True, fastmath=True, cache=True)
-def _generate_udf_native(width, height, d, z, v, i, j, result):
-    for x in range(width):
-        f = result[:,x]
-        edt(f, d, z, v, j[:,x], height)
-        result[:,x] = d[:height]
-    for y in range(height):
-        f = result[y,:]
-        edt(f, d, z, v, i[y,:], width)
-        result[y,:] = d[:width]
+def _edt_wrapped(f, d, z, v, k, n, wrap, s2):
+    # Transform the scanline held in f[:n], leaving the result in d[:n]
+    # and k[:n]. To make the transform periodic, the lower envelope is
+    # found for three back-to-back copies of the scanline, and only the
+    # middle copy is kept. This gives the same result as tripling the
+    # entire image, without ever allocating it. Closest-point indices
+    # are wrapped back into the range of the original scanline.
+    if not wrap:
+        edt(f, d, z, v, k, n, s2)
+        return
+    f[n:2 * n] = f[:n]
+    f[2 * n:3 * n] = f[:n]
+    edt(f, d, z, v, k, 3 * n, s2)
+    for q in range(n):
+        d[q] = d[n + q]
+        k[q] = (k[n + q] - n) % n
 
 @jit(nopython=True, fastmath=True, cache=True)
-def edt(f, d, z, v, i, n):
+def edt(f, d, z, v, i, n, s2=1.0):
     # Find the lower envelope of a sequence of parabolas.
     #   f...source data (returns the Y of the parabola vertex at X)
     #   d...destination data (final distance values are written here)
@@ -135,6 +658,7 @@ def edt(f, d, z, v, i, n):
     #   v...temporary used to store X coords of parabola vertices
     #   i...resulting X coords of parabola vertices
     #   n...number of pixels in "f" to process
+    #   s2..squared distance between adjacent pixels
 
     # Always add the first pixel to the enveloping set since it is
     # obviously lower than all parabolas processed so far.
@@ -149,12 +673,14 @@ def edt(f, d, z, v, i, n):
         # the envelope, remove it from the envelope. To make this
         # determination, find the X coordinate of the intersection (s)
         # between the parabolas with vertices at (q,f[q]) and (p,f[p]).
+        # The first parabola is never removed, because with non-unit
+        # spacing the intersection can fall below the -INF sentinel.
         p = v[k]
-        s = ((f[q] + q*q) - (f[p] + p*p)) / (2.0*q - 2.0*p)
-        while s <= z[k]:
+        s = ((f[q] + s2*q*q) - (f[p] + s2*p*p)) / (s2 * (2.0*q - 2.0*p))
+        while k > 0 and s <= z[k]:
             k = k - 1
             p = v[k]
-            s = ((f[q] + q*q) - (f[p] + p*p)) / (2.0*q - 2.0*p)
+            s = ((f[q] + s2*q*q) - (f[p] + s2*p*p)) / (s2 * (2.0*q - 2.0*p))
 
         # Add the new parabola to the envelope.
         k = k + 1
@@ -169,5 +695,5 @@ def edt(f, d, z, v, i, n):
         while z[k + 1] < float(q):
             k = k + 1
         dx = q - v[k]
-        d[q] = dx * dx + f[v[k]]
+        d[q] = s2 * dx * dx + f[v[k]]
         i[q] = v[k]
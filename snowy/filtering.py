@@ -2,11 +2,13 @@
 
 from . import io
 from collections import namedtuple
-from numba import guvectorize
-import math
+from numba import guvectorize, jit, prange
+import functools
+import numba
 import numpy as np
 
 RowOps = namedtuple('RowOps', 'tindices sindices fweights'.split())
+_RowWindows = namedtuple('_RowWindows', 'starts fweights'.split())
 
 GAUSSIAN_SCALE = 1.0 / np.sqrt(0.5 * np.pi)
 
@@ -26,8 +28,7 @@ def nearest(x):
     return np.less_equal(x, 0.5) * 1.0
 
 def sinc(x):
-    if x <= 0.00001: return 1.0
-    return np.sin(np.pi * x) / (np.pi * x)
+    return np.sinc(x)
 
 def lanczos(x):
     x = np.clip(x, 0, 1)
@@ -44,10 +45,13 @@ def mitchell(x):
     Q1 = (-12*B -48*C) / 6.0
     Q2 = (6*B +30*C) / 6.0
     Q3 = (-1*B - 6*C) / 6.0
-    if x >= 2.0: return 0.0
-    if x >= 1.0: return Q0 + Q1*x + Q2*x*x + Q3*x*x*x
-    return P0 + P1*x + P2*x*x + P3*x*x*x
+    q = Q0 + Q1*x + Q2*x*x + Q3*x*x*x
+    p = P0 + P1*x + P2*x*x + P3*x*x*x
+    return np.where(x >= 2.0, 0.0, np.where(x >= 1.0, q, p))
 
+# Filter functions are evaluated on numpy arrays of distances. Functions
+# that only accept scalars still work, but they are evaluated one
+# distance at a time through np.vectorize.
 class Filter:
     def __init__(self, fn, radius):
         self.radius = radius
@@ -60,93 +64,371 @@ NEAREST  = Filter(nearest, 0)
 LANCZOS  = Filter(lanczos, 1)
 MITCHELL = Filter(mitchell, 2)
 
+# When passed to blur, this approximates GAUSSIAN using a sequence of
+# box filters whose cost does not depend on the radius. When passed to
+# resize, it behaves exactly like GAUSSIAN.
+FAST_GAUSSIAN = Filter(gaussian, 2)
+
 def resize(source, width=None, height=None, filter=None, radius=1,
-           wrapx=False, wrapy=False):
+           wrapx=False, wrapy=False, out=None):
     """Create a new numpy image with the desired size.
 
     Either width or height can be null, in which case its value
-    is inferred from the aspect ratio of the source image.
+    is inferred from the aspect ratio of the source image, or from the
+    shape of <code>out</code> if it is provided. The result is
+    written into <code>out</code> when it is provided.
 
     Filter can be HERMITE, TRIANGLE, GAUSSIAN, NEAREST, LANCZOS, or
-    MITCHELL.
+    MITCHELL. Custom filter functions are fastest when they accept a
+    numpy array of distances, but scalar functions also work.
     """
     assert len(source.shape) == 3, 'Shape is not rows x cols x channels'
+    if out is not None and width == None and height == None:
+        height, width = out.shape[:2]
     assert width != None or height != None,  'Missing target size'
     aspect = source.shape[1] / source.shape[0]
     if width == None: width = height * aspect
     if height == None: height = width / aspect
     magnifying = width > source.shape[1]
     if filter == None: filter = MITCHELL if magnifying else LANCZOS
-    return resample(source, width, height, filter, radius, wrapx, wrapy)
+    return resample(source, width, height, filter, radius, wrapx, wrapy,
+                    out=out)
 
-def resample(source, width, height, filter, radius, wrapx, wrapy):
+def resample(source, width, height, filter, radius, wrapx, wrapy,
+             method='gather', out=None):
+    # The "gather" method evaluates each target pixel from a contiguous
+    # window of source pixels, while the "scatter" method accumulates
+    # into the target from an arbitrary list of operations.
+    assert method in ('gather', 'scatter'), 'Unknown resampling method'
     nchans = source.shape[2]
-    def fn(t): return filter.function(t / radius)
-    scaled_filter = Filter(fn, radius * filter.radius)
     srows, scols = source.shape[0], source.shape[1]
     trows, tcols = int(height), int(width)
-    vresult = np.zeros([srows, tcols, nchans])
-    rowops = create_ops(tcols, scols, scaled_filter, wrapx)
+    dtype = io._float_dtype(source)
+    result = io._prepare_out(out, [trows, tcols, nchans], dtype)
+    if method == 'gather' and result.flags.c_contiguous:
+        _resample_gather(result, source, filter, radius, wrapx, wrapy)
+        return result
+    if method == 'gather':
+        np.copyto(result, resample(source, width, height, filter, radius,
+                                   wrapx, wrapy, method))
+        return result
+    if source.dtype != dtype: source = np.asarray(source, dtype)
+    vresult = np.zeros([srows, tcols, nchans], dtype)
+    rowops = create_ops(tcols, scols, filter, radius, wrapx)
     convolve(vresult, source, rowops)
     vresult = transpose(vresult)
-    hresult = np.zeros([tcols, trows, nchans])
-    rowops = create_ops(trows, srows, scaled_filter, wrapy)
+    hresult = np.zeros([tcols, trows, nchans], dtype)
+    rowops = create_ops(trows, srows, filter, radius, wrapy)
     convolve(hresult, vresult, rowops)
-    return transpose(hresult)
+    np.copyto(result, transpose(hresult))
+    return result
+
+def _resample_gather(target, source, filter, radius, wrapx, wrapy,
+                     scratch=None):
+    # Resample into an existing image. The intermediate image produced
+    # by the horizontal pass lives in the optional scratch array, which
+    # can be larger than needed. The source is not read during the
+    # vertical pass, so the target is allowed to be the source.
+    srows, scols, nchans = source.shape
+    trows, tcols = target.shape[:2]
+    size = srows * tcols * nchans
+    if scratch is None: scratch = np.empty(size, target.dtype)
+    hresult = np.reshape(scratch[:size], (srows, tcols, nchans))
+    gather(hresult, source, create_windows(tcols, scols, filter,
+                                           radius, wrapx))
+    gather_rows(target, hresult, create_windows(trows, srows,
+                                           filter, radius, wrapy))
 
-def blur(image, filter=GAUSSIAN, radius=4, wrapx=False, wrapy=False):
+def generate_mipmaps(image, filter=None, wrapx=False, wrapy=False):
+    """Create a list of successively halved images, down to 1x1.
+
+    The first level is a copy of the source image. All levels are views
+    into a single contiguous array (which is their <code>base</code>)
+    so that the entire chain can be exported without copying. By
+    default, each level is the 2x2 box average of the level above it,
+    falling back to LANCZOS for odd sizes. Any filter accepted by
+    <a href="#resize">resize</a> can be used instead.
+    """
+    assert len(image.shape) == 3, 'Shape is not rows x cols x channels'
+    height, width, nchans = image.shape
+    shapes = [(height, width, nchans)]
+    while height > 1 or width > 1:
+        height, width = max(height // 2, 1), max(width // 2, 1)
+        shapes.append((height, width, nchans))
+    block = np.empty(sum(np.prod(shape) for shape in shapes),
+                     io._float_dtype(image))
+    levels, offset = [], 0
+    for shape in shapes:
+        size = np.prod(shape)
+        levels.append(np.reshape(block[offset:offset + size], shape))
+        offset += size
+    np.copyto(levels[0], image)
+    scratch = None
+    for source, target in zip(levels[:-1], levels[1:]):
+        yscale = source.shape[0] // target.shape[0]
+        xscale = source.shape[1] // target.shape[1]
+        exact = target.shape[0] * yscale == source.shape[0] and \
+                target.shape[1] * xscale == source.shape[1]
+        if filter == None and exact:
+            jit_box_reduce(target, source, yscale, xscale)
+        else:
+            # Levels only get smaller, so the scratch space allocated
+            # for the first resampled level can be used for the rest.
+            if scratch is None:
+                size = source.shape[0] * target.shape[1] * nchans
+                scratch = np.empty(size, target.dtype)
+            _resample_gather(target, source, filter or LANCZOS, 1,
+                             wrapx, wrapy, scratch)
+    return levels
+
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def jit_box_reduce(target, source, yscale, xscale):
+    nrows, ncols, nchan = target.shape
+    scale = 1.0 / (yscale * xscale)
+    for row in prange(nrows):
+        for col in range(ncols):
+            for c in range(nchan):
+                total = 0.0
+                for y in range(row * yscale, (row + 1) * yscale):
+                    for x in range(col * xscale, (col + 1) * xscale):
+                        total += source[y, x, c]
+                target[row, col, c] = total * scale
+
+def blur(image, filter=GAUSSIAN, radius=4, wrapx=False, wrapy=False,
+         out=None):
     """Resample an image and produce a new image with the same size.
     
     For a list of available filters, see <a href="#resize">resize</a>.
+    Additionally, FAST_GAUSSIAN approximates GAUSSIAN with three box
+    filters in constant time per pixel, regardless of radius. Below a
+    radius of 3, the boxes would be a single pixel wide, so GAUSSIAN is
+    used instead. The
+    result is written into <code>out</code> when it is provided, which
+    can be the image itself.
     """
+    # Radii that are too small to be split into boxes are blurred with
+    # GAUSSIAN, which is cheap for them anyway.
+    if filter is FAST_GAUSSIAN and min(_box_radii(radius / 2.0)) > 0:
+        return _box_blur(image, radius, wrapx, wrapy, out)
+    if filter is FAST_GAUSSIAN:
+        filter = GAUSSIAN
     width, height = image.shape[1], image.shape[0]
-    return resize(image, width, height, filter, radius, wrapx, wrapy)
+    return resize(image, width, height, filter, radius, wrapx, wrapy, out)
+
+_BOX_TILE = 64
+
+def _box_blur(image, radius, wrapx, wrapy, out):
+    assert len(image.shape) == 3, 'Shape is not rows x cols x channels'
+    # The GAUSSIAN filter at a given radius has a standard deviation of
+    # half that radius.
+    radii = _box_radii(radius / 2.0)
+    height, width, nchans = image.shape
+    result = io._prepare_out(out, image.shape, io._float_dtype(image))
+    if not result.flags.c_contiguous:
+        np.copyto(result, _box_blur(image, radius, wrapx, wrapy, None))
+        return result
+    np.copyto(result, image)
+    nchunks = numba.get_num_threads()
+    xnorm = _box_norm(width, radii, wrapx)
+    jit_box_blur_rows(result, radii, wrapx, xnorm, nchunks)
+    ynorm = _box_norm(height, radii, wrapy)
+    flat = np.reshape(result, (height, width * nchans))
+    jit_box_blur_columns(flat, radii, wrapy, ynorm, _BOX_TILE, nchunks)
+    return result
+
+def _box_radii(sigma, nboxes=3):
+    # Choose the box sizes whose successive application has the given
+    # standard deviation, as described in "Fast Almost-Gaussian
+    # Filtering" by Peter Kovesi.
+    wideal = np.sqrt(12.0 * sigma * sigma / nboxes + 1.0)
+    wl = int(np.floor(wideal))
+    if wl % 2 == 0: wl -= 1
+    wu = wl + 2
+    mideal = (12.0 * sigma * sigma - nboxes * wl * wl - 4 * nboxes * wl -
+              3 * nboxes) / (-4.0 * wl - 4.0)
+    m = int(round(mideal))
+    sizes = [wl if i < m else wu for i in range(nboxes)]
+    return np.int64([max(size // 2, 0) for size in sizes])
+
+def _box_norm(n, radii, wrap):
+    # Without wrapping, pixels that fall outside the image are excluded
+    # from the average, so each output pixel is divided by the portion
+    # of the filter that lies inside the image.
+    norm = np.ones([n, 1])
+    if not wrap:
+        length = _box_length(n, radii)
+        src, dst = np.empty([length, 1]), np.empty([length, 1])
+        _box_filter(norm, radii, wrap, np.ones(n), src, dst, np.empty(1))
+    return norm[:,0]
+
+@jit(nopython=True, fastmath=True, cache=True)
+def _box_filter(lines, radii, wrap, norm, src, dst, acc):
+    # Apply a sequence of box filters along the first axis of a 2D
+    # array, in place, using running sums. The array is padded such
+    # that the result is not affected by the (zero or wrapped) values
+    # beyond the image. The caller provides src, dst and acc scratch
+    # buffers with room for at least the padded length and m columns.
+    n, m = lines.shape
+    length = _box_length(n, radii)
+    pad = (length - n) // 2
+    for i in range(length):
+        s = i - pad
+        if wrap:
+            s %= n
+        elif s < 0 or s >= n:
+            for j in range(m):
+                src[i, j] = 0
+            continue
+        for j in range(m):
+            src[i, j] = lines[s, j]
+    for r in radii:
+        scale = 1.0 / (2 * r + 1)
+        acc[:] = 0
+        for i in range(min(r + 1, length)):
+            for j in range(m):
+                acc[j] += src[i, j]
+        for i in range(length):
+            for j in range(m):
+                dst[i, j] = acc[j] * scale
+            if i + r + 1 < length:
+                for j in range(m):
+                    acc[j] += src[i + r + 1, j]
+            if i - r >= 0:
+                for j in range(m):
+                    acc[j] -= src[i - r, j]
+        src, dst = dst, src
+    for i in range(n):
+        for j in range(m):
+            lines[i, j] = src[i + pad, j] / norm[i]
+
+@jit(nopython=True, fastmath=True, cache=True)
+def _box_length(n, radii):
+    pad = 0
+    for r in radii: pad += r
+    return n + 2 * pad
+
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def jit_box_blur_rows(image, radii, wrap, norm, nchunks):
+    # Each chunk of rows allocates its scratch buffers once.
+    nrows, ncols, nchans = image.shape
+    length = _box_length(ncols, radii)
+    nchunks = min(nchunks, nrows)
+    for chunk in prange(nchunks):
+        src = np.empty((length, nchans))
+        dst = np.empty((length, nchans))
+        acc = np.empty(nchans)
+        for row in range(chunk, nrows, nchunks):
+            _box_filter(image[row], radii, wrap, norm, src, dst, acc)
+
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def jit_box_blur_columns(image, radii, wrap, norm, tilesize, nchunks):
+    # Each chunk of column tiles allocates its scratch buffers once.
+    # Tiles are narrow, so that the padded scratch for tall images
+    # stays small.
+    nrows, ncols = image.shape
+    length = _box_length(nrows, radii)
+    ntiles = (ncols + tilesize - 1) // tilesize
+    nchunks = min(nchunks, ntiles)
+    for chunk in prange(nchunks):
+        src = np.empty((length, tilesize))
+        dst = np.empty((length, tilesize))
+        acc = np.empty(tilesize)
+        for tile in range(chunk, ntiles, nchunks):
+            x0 = tile * tilesize
+            x1 = min(x0 + tilesize, ncols)
+            _box_filter(image[:, x0:x1], radii, wrap, norm, src, dst, acc)
 
 def transpose(source: np.ndarray):
     return np.swapaxes(source, 0, 1)
 
-def create_ops(ntarget, nsource, filter: Filter, wrap) -> RowOps:
+@functools.lru_cache(maxsize=64)
+def create_ops(ntarget, nsource, filter: Filter, radius, wrap) -> RowOps:
     # Generate a sequence of operations to perform a 1D convolution
     # where each operation is represented by 3-tuple of: target index,
-    # source index, weight.
-    tindices, sindices, fweights = [], [], []
+    # source index, weight. The tuples are returned as three parallel
+    # arrays that are cached, since resize and blur are often called
+    # repeatedly with the same geometry. Do not modify them.
+    taps, weights = _create_taps(ntarget, nsource, filter, radius, wrap)
+    tindices = np.broadcast_to(np.arange(ntarget)[:,np.newaxis], taps.shape)
+    nonzero = weights != 0
+    rowops = RowOps(np.int32(tindices[nonzero]),
+                    np.int32(taps[nonzero] % nsource),
+                    np.float64(weights[nonzero]))
+    for array in rowops: array.setflags(write=False)
+    return rowops
+
+@functools.lru_cache(maxsize=64)
+def create_windows(ntarget, nsource, filter: Filter, radius,
+                   wrap) -> _RowWindows:
+    # Generate a fixed-width window of source pixels for each target
+    # pixel, represented by the index of its first source pixel and a
+    # row of weights that is padded with zeros. With wrapping, the
+    # window indices are taken modulo the size of the source. Like
+    # create_ops, the returned arrays are cached and must not be
+    # modified.
+    taps, weights = _create_taps(ntarget, nsource, filter, radius, wrap)
+    rows = np.broadcast_to(np.arange(ntarget)[:,np.newaxis], taps.shape)
+    if wrap:
+        nwindow = min(taps.shape[1], nsource)
+        starts = taps[:,0] % nsource
+        offsets = (taps - taps[:,:1]) % nsource
+    else:
+        lo = np.clip(taps[:,0], 0, nsource - 1)
+        hi = np.clip(taps[:,-1], 0, nsource - 1)
+        nwindow = np.amax(hi - lo) + 1
+        starts = np.minimum(lo, nsource - nwindow)
+        offsets = np.clip(taps - starts[:,np.newaxis], 0, nwindow - 1)
+    fweights = np.zeros([ntarget, nwindow])
+    np.add.at(fweights, (rows, offsets), weights)
+    windows = _RowWindows(np.int32(starts), fweights)
+    for array in windows: array.setflags(write=False)
+    return windows
+
+def _create_taps(ntarget, nsource, filter: Filter, radius, wrap):
+    # Evaluate the filter for every (target, source) pair that might
+    # overlap, all at once. Returns two ntarget x ntaps arrays: the
+    # (unwrapped) source index of each tap and its normalized weight.
+    # Taps that fall outside the source have zero weight unless wrap is
+    # enabled.
     dtarget = 1.0 / ntarget
     dsource = 1.0 / nsource
     minifying = ntarget < nsource
     fextent = dtarget if minifying else dsource
     fdomain = float(ntarget if minifying else nsource)
-    x = dtarget / 2
-    for tindex in range(ntarget):
-        minx = x - filter.radius * fextent
-        maxx = x + filter.radius * fextent
-        minsi = int(minx * float(nsource))
-        maxsi = int(math.ceil(maxx * float(nsource)))
-        localops = []
-        weightsum = 0.0
-        for sindex in range(minsi, maxsi+1):
-            wrapped = sindex
-            if sindex < 0 or sindex >= nsource:
-                if wrap:
-                    wrapped = sindex % nsource
-                else:
-                    continue
-            sx = (0.5 + sindex) * dsource
-            t = fdomain * abs(sx - x)
-            weight = filter.function(t)
-            if weight != 0:
-                localops.append((tindex, wrapped, weight))
-                weightsum += weight
-        if weightsum > 0.0:
-            for op in localops:
-                tindices.append(op[0])
-                sindices.append(op[1])
-                fweights.append(op[2] / weightsum)
-        x += dtarget
-    return RowOps(tindices, sindices, fweights)
+    fradius = radius * filter.radius
+    # Accumulate target coordinates exactly like a scalar loop would, so
+    # that ties in the NEAREST filter are broken consistently.
+    x = np.cumsum(np.append(dtarget / 2, np.full(ntarget - 1, dtarget)))
+    minsi = np.trunc((x - fradius * fextent) * nsource).astype(int)
+    maxsi = np.ceil((x + fradius * fextent) * nsource).astype(int)
+    ntaps = np.amax(maxsi - minsi) + 1
+    taps = minsi[:,np.newaxis] + np.arange(ntaps)
+    valid = taps <= maxsi[:,np.newaxis]
+    if not wrap:
+        valid &= (taps >= 0) & (taps < nsource)
+    sx = (0.5 + taps) * dsource
+    t = fdomain * np.abs(sx - x[:,np.newaxis])
+    weights = np.where(valid, _evaluate_filter(filter, t / radius), 0.0)
+    weightsum = np.sum(weights, axis=1, keepdims=True)
+    weights = np.divide(weights, weightsum, where=weightsum > 0.0,
+                        out=np.zeros(weights.shape))
+    return taps, weights
+
+def _evaluate_filter(filter: Filter, t):
+    # Fall back to per-element evaluation for filters that were written
+    # for scalars, e.g. with math.exp or an if statement.
+    try:
+        weights = np.asarray(filter.function(t), dtype=np.float64)
+        if weights.shape == t.shape:
+            return weights
+    except (TypeError, ValueError):
+        pass
+    return np.vectorize(filter.function, otypes=[np.float64])(t)
 
 SIG0 = "void(f8[:,:,:], f8[:,:,:], i4[:], i4[:], f8[:])"
 SIG1 = "(r0,c0,d),(r0,c1,d),(i),(i),(i)"
-@guvectorize([SIG0], SIG1, target='parallel', cache=True)
+SIG2 = "void(f4[:,:,:], f4[:,:,:], i4[:], i4[:], f8[:])"
+@guvectorize([SIG0, SIG2], SIG1, target='parallel', cache=True)
 def jit_convolve(target, source, tinds, sinds, weights):
     nrows, nchan, nops = target.shape[0], target.shape[2], len(tinds)
     for c in range(nchan):
@@ -155,6 +437,76 @@ def jit_convolve(target, source, tinds, sinds, weights):
                 tind, sind, weight = tinds[op], sinds[op], weights[op]
                 target[row][tind][c] += source[row][sind][c] * weight
 
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def jit_gather(target, source, starts, weights):
+    nrows, ntarget, nchan = target.shape
+    nsource, nwindow = source.shape[1], weights.shape[1]
+    for row in prange(nrows):
+        for tind in range(ntarget):
+            for c in range(nchan):
+                target[row, tind, c] = 0
+            sind = starts[tind]
+            for k in range(nwindow):
+                weight = weights[tind, k]
+                for c in range(nchan):
+                    target[row, tind, c] += source[row, sind, c] * weight
+                sind += 1
+                if sind == nsource: sind = 0
+
+def gather(target, source, windows: _RowWindows):
+    # Perform a 1D convolution where every target pixel is a weighted
+    # sum over a window of consecutive source pixels. This is
+    # equivalent to:
+    #
+    # for t in range(target.shape[1]):
+    #     for k in range(len(fweights[t])):
+    #         s = (starts[t] + k) % source.shape[1]
+    #         target[:,t] += source[:,s] * fweights[t][k]
+    #
+    # Unlike convolve, every target pixel is written exactly once.
+    starts, fweights = windows
+    assert len(starts) == len(fweights) == target.shape[1]
+    assert len(target) == len(source)
+    jit_gather(target, source, starts, fweights)
+
+# Number of floats in each column tile processed by jit_gather_rows.
+# This is small enough for a full window of source rows to stay cached.
+_TILE_SIZE = 1024
+
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def jit_gather_rows(target, source, starts, weights, tilesize):
+    ntarget, ncols = target.shape
+    nsource, nwindow = source.shape[0], weights.shape[1]
+    ntiles = (ncols + tilesize - 1) // tilesize
+    for job in prange(ntiles * ntarget):
+        tind = job % ntarget
+        x0 = (job // ntarget) * tilesize
+        x1 = min(x0 + tilesize, ncols)
+        for x in range(x0, x1):
+            target[tind, x] = 0
+        sind = starts[tind]
+        for k in range(nwindow):
+            weight = weights[tind, k]
+            if weight != 0:
+                for x in range(x0, x1):
+                    target[tind, x] += source[sind, x] * weight
+            sind += 1
+            if sind == nsource: sind = 0
+
+def gather_rows(target, source, windows: _RowWindows):
+    # Similar to gather, but convolves along the first axis such that
+    # every target row is a weighted sum of consecutive source rows.
+    # Rather than transposing the image, this walks down the columns
+    # in cache-sized tiles, each of which is a contiguous run of
+    # pixels since rows are processed as flat arrays.
+    starts, fweights = windows
+    assert len(starts) == len(fweights) == len(target)
+    assert target.shape[1:] == source.shape[1:]
+    assert target.flags.c_contiguous, 'Target rows must be contiguous'
+    target = np.reshape(target, (len(target), -1))
+    source = np.reshape(source, (len(source), -1))
+    jit_gather_rows(target, source, starts, fweights, _TILE_SIZE)
+
 def convolve(target, source, rowops: RowOps):
     # Perform highly generalized 1D convolution. This is almost
     # equivalent to:
@@ -171,6 +523,4 @@ def convolve(target, source, rowops: RowOps):
     tindices, sindices, fweights = rowops
     assert len(tindices) == len(sindices) == len(fweights)
     assert len(target) == len(source)
-    jit_convolve(target, source,
-                 np.int32(tindices), np.int32(sindices),
-                 np.double(fweights))
+    jit_convolve(target, source, tindices, sindices, fweights)
@@ -72,23 +72,38 @@ def unshape(image):
         return np.reshape(image, image.shape[:2])
     return image
 
-def _load(filename: str, extension: str, linear: bool):
+def _float_dtype(image: np.ndarray):
+    # Images are processed in single precision if they are float32, and
+    # in double precision otherwise.
+    return np.float32 if image.dtype == np.float32 else np.float64
+
+def _prepare_out(out, shape, dtype):
+    # Allocate a destination image, or check that the destination image
+    # provided by the caller has the expected shape and type.
+    if out is None:
+        return np.empty(shape, dtype)
+    assert out.shape == tuple(shape), 'Output has the wrong shape'
+    assert out.dtype == dtype, 'Output has the wrong dtype'
+    return out
+
+def _load(filename: str, extension: str, linear: bool, dtype):
     if extension == '.png':
         img = imageio.imread(filename, 'PNG-PIL', pilmode='RGBA')
-        img = np.clip(np.float64(img) / 255, 0, None)    
+        img = np.clip(np.asarray(img, dtype) / 255, 0, None)
     elif extension == '.jpg' or extension == '.jpeg':
         img = imageio.imread(filename)
-        img = np.clip(np.float64(img) / 255, 0, None)
+        img = np.clip(np.asarray(img, dtype) / 255, 0, None)
     elif extension == '.exr':
         imageio.plugins.freeimage.download()
-        img = np.float64(imageio.imread(filename))
+        img = np.asarray(imageio.imread(filename), dtype)
     return linearize(img) if not linear else img
 
-def load(filename: str, linearize=True) -> np.ndarray:
+def load(filename: str, linearize=True, dtype=np.float64) -> np.ndarray:
     """Create a numpy array from the given PNG, JPEG, or EXR image file.
 
     Regardless of the pixel format on disk, PNG / JPEG images are always
     divided by 255, and PNG images are extended to 4 color channels.
+    Pass <code>dtype=np.float32</code> to load a single precision image.
 
     See also <a href="#reshape">reshape</a> and
     <a href="#linearize">linearize</a>  (which this calls).
@@ -96,7 +111,8 @@ def load(filename: str, linearize=True) -> np.ndarray:
 
     ext = filename[filename.rfind('.'):]
     assert ext == '.png' or ext == '.jpeg' or ext == '.jpg' or ext == '.exr'
-    return reshape(np.float64(_load(filename, ext, not linearize)))
+    assert dtype in (np.float32, np.float64), 'Images must be float32 or float64'
+    return reshape(np.asarray(_load(filename, ext, not linearize, dtype), dtype))
 
 def _export(image: np.ndarray, filename: str, linear):
     image_format = None
@@ -147,7 +163,7 @@ def ensure_alpha(src: np.ndarray) -> np.ndarray:
     assert len(src.shape) == 3
     if src.shape[2] != 3:
         return src
-    alpha = np.ones(src.shape[:2])
+    alpha = np.ones(src.shape[:2], dtype=src.dtype)
     r, g, b = to_planar(src)
     return from_planar(np.array([r, g, b, alpha]))
 
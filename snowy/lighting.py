@@ -1,6 +1,7 @@
 from . import io
 from numba import prange, jit
 import math
+import numba
 import numpy as np
 
 SWEEP_DIRECTIONS = np.int16([
@@ -10,140 +11,475 @@ SWEEP_DIRECTIONS = np.int16([
     (1, 2), (1, -2), (-1, 2), (-1, -2) # Knight
 ])
 
-def compute_skylight(elevation, verbose=False):
-    """Compute ambient occlusion from a height map."""
+_NEAR_SAMPLES = 16
+_PYRAMID_STRIP = 256
+
+def compute_skylight(elevation, verbose=False, directions=None):
+    """Compute ambient occlusion from a height map.
+
+    By default, the horizon is scanned along 16 directions. Pass an
+    integer to use that many evenly spaced directions instead, such as
+    4 for quick previews or 64 for final bakes, or pass a list of
+    integer (dx, dy) steps.
+    """
     height, width, nchan = elevation.shape
     assert nchan == 1
+    directions = _sweep_directions(directions)
     result = np.zeros([height, width])
-    _compute_skylight(result, elevation[:,:,0], verbose)
-    return io.reshape(np.clip(1.0 - result, 0, 1))
+    _compute_skylight(result, elevation[:,:,0], verbose, directions)
+    return _finish_skylight(result, len(directions), elevation)
+
+def compute_skylight_progressive(elevation, directions=64, batch_size=4,
+                                 verbose=False):
+    """Yield increasingly accurate ambient occlusion from a height map.
+
+    The directions are split into batches of batch_size, each of which
+    is spread evenly around the horizon, and an estimate is yielded
+    after every batch. The last estimate is the same as the result of
+    <a href="#compute_skylight">compute_skylight</a>.
+    """
+    height, width, nchan = elevation.shape
+    assert nchan == 1
+    directions = _sweep_directions(directions)
+    nbatches = -(-len(directions) // batch_size)
+    result = np.zeros([height, width])
+    count = 0
+    for batch in range(nbatches):
+        subset = directions[batch::nbatches]
+        _compute_skylight(result, elevation[:,:,0], verbose, subset)
+        count += len(subset)
+        yield _finish_skylight(result, count, elevation)
+
+def compute_skylight_tiled(elevation, max_distance, tile_size=256,
+                           directions=None, out=None, bounds=None,
+                           pyramid=None):
+    """Compute ambient occlusion from a huge height map, tile by tile.
+
+    Horizons are only searched up to max_distance pixels away. Nearby
+    terrain is sampled at full resolution, and distant terrain is
+    sampled from the coarser levels created by
+    <a href="#generate_max_pyramid">generate_max_pyramid</a>. If no
+    pyramid is given, one is built in memory first. Each tile then only
+    reads a bounded window of the height map and of each level, so the
+    elevation, the pyramid and the <code>out</code> image can all be
+    np.memmap.
+
+    To split the work across processes, pass bounds as (left, top,
+    right, bottom) with exclusive right and bottom. Only the pixels
+    within bounds are written into <code>out</code>. See
+    <a href="#compute_skylight">compute_skylight</a> for directions.
+    """
+    height, width, nchan = elevation.shape
+    assert nchan == 1
+    directions = _sweep_directions(directions)
+    dtype = io._float_dtype(elevation)
+    if out is None and bounds is not None:
+        out = np.zeros(elevation.shape, dtype)
+    result = io._prepare_out(out, elevation.shape, dtype)
+    if pyramid is None:
+        pyramid = generate_max_pyramid(elevation, max_distance)
+    assert len(pyramid) >= _pyramid_depth(max_distance), 'Too few levels'
+    left, top, right, bottom = bounds or (0, 0, width, height)
+    left, top = max(left, 0), max(top, 0)
+    right, bottom = min(right, width), min(bottom, height)
+    steps = np.float64(directions)
+    steps /= np.sqrt(np.sum(steps * steps, axis=1))[:,np.newaxis]
+    for y0 in range(top, bottom, tile_size):
+        for x0 in range(left, right, tile_size):
+            y1 = min(y0 + tile_size, bottom)
+            x1 = min(x0 + tile_size, right)
+            heights, windows = _skylight_windows(elevation, pyramid,
+                                                 y0, y1, x0, x1, max_distance)
+            occlusion = np.empty([y1 - y0, x1 - x0])
+            _skylight_tile(occlusion, heights, windows, steps, y0, x0,
+                           height, width, max_distance, _NEAR_SAMPLES)
+            result[y0:y1,x0:x1] = _finish_skylight(occlusion,
+                                                   len(directions), result)
+    return result
+
+def generate_max_pyramid(elevation, max_distance, out=None):
+    """Create the coarse height maps used by compute_skylight_tiled.
+
+    Each level holds the highest elevation in each 2x2 block of the
+    level above it, starting from the elevation itself, so distant
+    horizons are never underestimated. Only as many levels as
+    max_distance needs are created, which may be none.
 
-def compute_normals(elevation):
+    Level n has ceil(height / 2<sup>n</sup>) rows and
+    ceil(width / 2<sup>n</sup>) columns, with a single float32 channel.
+    For terrains that do not fit in memory, pass a list of np.memmap
+    levels as <code>out</code>. They are filled in strips, and can be
+    shared by several processes running
+    <a href="#compute_skylight_tiled">compute_skylight_tiled</a>.
+    """
+    height, width, nchan = elevation.shape
+    assert nchan == 1
+    depth = _pyramid_depth(max_distance)
+    shapes = [(-(-height >> n), -(-width >> n), 1) for n in range(1, depth + 1)]
+    if out is None:
+        out = [np.empty(shape, np.float32) for shape in shapes]
+    assert len(out) == depth, 'Wrong number of levels'
+    source = elevation
+    for shape, level in zip(shapes, out):
+        level = io._prepare_out(level, shape, np.float32)
+        for y in range(0, source.shape[0], 2 * _PYRAMID_STRIP):
+            strip = np.float32(source[y:y + 2 * _PYRAMID_STRIP,:,0])
+            level[y // 2:y // 2 + _PYRAMID_STRIP,:,0] = _max_reduce(strip)
+        source = level
+    return out
+
+def compute_normals(elevation, central=False, wrapx=False, wrapy=False,
+                    spacing=None, zscale=1.0, dtype=None):
     """Generate a 3-channel normal map from a height map.
 
-    The normal components are in the range [-1,+1] and the size of the
-    normal map is (width-1, height-1) due to forward differencing.
+    The normal components are in the range [-1,+1]. By default the
+    size of the normal map is (width-1, height-1) due to forward
+    differencing, unless the height map wraps along that axis. Pass
+    central=True to use central differences, which preserves the size.
+
+    The spacing between pixels defaults to one over the size of the
+    normal map along each axis. That is 1 / (width-1) horizontally with
+    forward differences that do not wrap, and 1 / width otherwise, and
+    likewise vertically. Elevations are multiplied by zscale. The dtype
+    can be float32, float64, or uint8, which packs the normals into
+    [0,255].
     """
     height, width, nchan = elevation.shape
     assert nchan == 1
-    normals = np.empty([height - 1, width - 1, 3])
-    _compute_normals(elevation[:,:,0], normals)
+    dtype = np.dtype(io._float_dtype(elevation) if dtype is None else dtype)
+    assert dtype in (np.float32, np.float64, np.uint8), 'Unsupported dtype'
+    ow = width if central or wrapx else width - 1
+    oh = height if central or wrapy else height - 1
+    normals = np.empty([oh, ow, 3], dtype)
+    if ow == 0 or oh == 0:
+        return normals
+    sx, sy = (1 / ow, 1 / oh) if spacing is None else spacing
+    _compute_normals(elevation[:,:,0], normals, central, wrapx, wrapy,
+                     zscale / sx, zscale / sy, dtype == np.uint8)
     return normals
 
-@jit(nopython=True, fastmath=True, cache=True)
-def _compute_normals(el, normals):
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _compute_normals(el, normals, central, wrapx, wrapy, kx, ky, pack):
+    # The normal is the cross product of the two tangents (1, 0, dz/dx)
+    # and (0, 1, dz/dy), which is (-dz/dx, -dz/dy, 1). Here gx and gy
+    # are the negated gradients, and sx and sy scale the differences.
+    height, width = el.shape
     h, w = normals.shape[:2]
-    for row in range(h):
+    for row in prange(h):
+        y0, y1 = _normal_taps(row, height, central, wrapy)
+        sy = ky / max(y1 - y0, 1) if not wrapy else ky / (1 + central)
         for col in range(w):
-            p =  np.float64((col / w, row / h, el[row][col]))
-            dx = np.float64(((col+1) / w, row / h, el[row][col+1]))
-            dy = np.float64((col / w, (row+1) / h, el[row+1][col]))
-            v1 = dx - p
-            v2 = dy - p
-            n = np.float64((
-                    (v1[1] * v2[2]) - (v1[2] * v2[1]),
-                    (v1[2] * v2[0]) - (v1[0] * v2[2]),
-                    (v1[0] * v2[1]) - (v1[1] * v2[0])))
-            isq = 1 / np.linalg.norm(n)
-            normals[row][col] = n * isq
-
-def _compute_skylight(dst, src, verbose):
-    height, width = src.shape
-    cnt = np.zeros(dst.shape, dtype='u8')
+            x0, x1 = _normal_taps(col, width, central, wrapx)
+            sx = kx / max(x1 - x0, 1) if not wrapx else kx / (1 + central)
+            gx = sx * (el[row, x0] - el[row, x1])
+            gy = sy * (el[y0, col] - el[y1, col])
+            isq = 1 / math.sqrt(gx * gx + gy * gy + 1)
+            if pack:
+                normals[row, col, 0] = gx * isq * 127.5 + 128
+                normals[row, col, 1] = gy * isq * 127.5 + 128
+                normals[row, col, 2] = isq * 127.5 + 128
+            else:
+                normals[row, col, 0] = gx * isq
+                normals[row, col, 1] = gy * isq
+                normals[row, col, 2] = isq
 
-    # TODO Fix allocation or explain the "3"
-    seedpoints = np.empty([3 * max(width, height), 2], dtype='i2')
-    maxpathlen = max(width, height) + 1
+@jit(nopython=True, fastmath=True, cache=True)
+def _normal_taps(i, n, central, wrap):
+    # Find the two samples to difference. Central differences fall back
+    # to one-sided differences at the edges of a height map that does
+    # not wrap.
+    i0 = i - central
+    i1 = i + 1
+    if wrap:
+        return i0 % n, i1 % n
+    return max(i0, 0), min(i1, n - 1)
 
-    for direction in SWEEP_DIRECTIONS:
-        nsweeps = _generate_seedpoints(src, direction, seedpoints)
-        if verbose:
+def _compute_skylight(dst, src, verbose, directions):
+    # Accumulate the occlusion of each direction into dst.
+    height, width = src.shape
+    seedpoints, offsets = _generate_seedpoints(width, height, directions)
+    if verbose:
+        for direction in directions:
             print('Horizon direction: ', direction)
-        sweeps = np.empty([nsweeps, maxpathlen, 3])
-        pts = np.empty([nsweeps, 3])
-        _horizon_scan(src, dst, cnt, direction, seedpoints, sweeps, pts)
-
-    dst /= cnt
-    dst *= 4 / np.pi
-
-# TODO This function needs to be rewritten or documented.
-def _generate_seedpoints(field, direction, seedpoints):
-    h, w = field.shape[:2]
-    s = 0
-    sx, sy = np.sign(direction)
-    ax, ay = np.abs(direction)
-    nsweeps = ay * w + ax * h - (ax + ay - 1)
-    for x in range(-ax, w - ax):
-        for y in range(-ay, h - ay):
-            if x >= 0 and x < w and y >= 0 and y < h: continue
-            px, py = x, y
-            if sx < 0: px = w - x - 1
-            if sy < 0: py = h - y - 1
-            seedpoints[s][0] = px
-            seedpoints[s][1] = py
-            s += 1
-    assert nsweeps == s
-    return nsweeps
-
-SIG0 = "void(f8[:,:],f8[:,:],u8[:,:],i2[:],i2[:,:],f8[:,:,:],f8[:,:])"
-@jit([SIG0], nopython=True, fastmath=True, parallel=True)
-def _horizon_scan(heights, occlusion, counts, direction, seedpoints,
-        sweeps, pts):
-    h, w = heights.shape[:2]
-    cellw = 1 / max(w, h)
-    cellh = 1 / max(w, h)
-    nsweeps = len(sweeps)
-    for sweep in prange(nsweeps):
-        thispt = pts[sweep]
-        stack = sweeps[sweep]
-        startpt = seedpoints[sweep]
-        pathlen = 0
-        i, j = startpt
-        ii, jj = min(max(0, i), w-1), min(max(0, j), h-1)
-
-        thispt[0] = i * cellw
-        thispt[1] = j * cellh
-        thispt[2] = heights[jj][ii]
-
-        stack_top = 0
-
-        stack[stack_top] = thispt
-
-        i += direction[0]
-        j += direction[1]
-        while i >= 0 and i < w and j >= 0 and j < h:
-
-            thispt[0] = i * cellw
-            thispt[1] = j * cellh
-            thispt[2] = heights[j][i]
-
-            while stack_top > 0:
-
-                a, b = thispt, stack[stack_top]
-                dx = b[0] - a[0]
-                dy = b[1] - a[1]
-                y = b[2] - a[2]
-                x = math.sqrt(dx * dx + dy * dy)
-                s1 = y / x
-
-                a, b = thispt, stack[stack_top - 1]
-                dx = b[0] - a[0]
-                dy = b[1] - a[1]
-                y = b[2] - a[2]
-                x = math.sqrt(dx * dx + dy * dy)
-                s2 = y / x
-
-                if s1 >= s2: break
-                stack_top -= 1
-
-            horizonpt = stack[stack_top]
-            stack_top += 1
-            stack[stack_top] = thispt
-
-            d = horizonpt - thispt
-            dx = d[2] / np.linalg.norm(d)
-            occlusion[j][i] += math.atan(max(dx, 0))
-            counts[j][i] += 1
-
-            i += direction[0]
-            j += direction[1]
+    nchunks = numba.get_num_threads()
+    _horizon_scan(src, dst, directions, seedpoints, offsets, nchunks)
+
+def _finish_skylight(occlusion, count, elevation):
+    # Every pixel lies on exactly one sweep per direction.
+    result = np.clip(1.0 - occlusion * (4 / np.pi / count), 0, 1)
+    return io.reshape(np.asarray(result, io._float_dtype(elevation)))
+
+def _pyramid_depth(max_distance):
+    # Level n is sampled out to _NEAR_SAMPLES * 2^n pixels, and the
+    # coarsest level is sampled out to max_distance.
+    depth = 0
+    while _NEAR_SAMPLES << depth < max_distance:
+        depth += 1
+    return depth
+
+def _max_reduce(level):
+    height, width = level.shape
+    level = np.pad(level, [(0, height % 2), (0, width % 2)], mode='edge')
+    return np.maximum(np.maximum(level[0::2,0::2], level[1::2,0::2]),
+                      np.maximum(level[0::2,1::2], level[1::2,1::2]))
+
+def _skylight_windows(elevation, pyramid, y0, y1, x0, x1, max_distance):
+    # Gather the part of each level that the samples of a tile can
+    # reach into one flat array. Level n is only sampled out to a
+    # distance of _NEAR_SAMPLES * 2^n pixels from the tile.
+    height, width = elevation.shape[:2]
+    levels = [None] + list(pyramid[:_pyramid_depth(max_distance)])
+    heights, windows, start = [], [], 0
+    for n, level in enumerate(levels):
+        scale = 1 << n
+        reach = min(_NEAR_SAMPLES * scale, max_distance) + 2 * scale
+        if n == len(levels) - 1:
+            reach = max_distance + 2 * scale
+        wy0 = max(int(y0 - reach), 0) // scale
+        wx0 = max(int(x0 - reach), 0) // scale
+        wy1 = -(-min(int(y1 + reach), height) // scale)
+        wx1 = -(-min(int(x1 + reach), width) // scale)
+        if n == 0:
+            window = np.float64(elevation[wy0:wy1,wx0:wx1,0])
+        else:
+            window = np.float32(level[wy0:wy1,wx0:wx1,0])
+        heights.append(window.ravel())
+        windows.append((start, wy0, wx0, wy1 - wy0, wx1 - wx0))
+        start += window.size
+    return np.concatenate(heights), np.int64(windows)
+
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _skylight_tile(occlusion, heights, windows, steps, y0, x0, height,
+                   width, max_distance, near):
+    # March outward from each pixel in every direction, keeping the
+    # steepest slope. The first samples are one pixel apart on the
+    # finest level. After that, each coarser level takes half as many
+    # samples with twice the spacing, until max_distance is reached.
+    cell = 1 / max(width, height)
+    nlevels = len(windows)
+    for row in prange(occlusion.shape[0]):
+        y = y0 + row
+        for col in range(occlusion.shape[1]):
+            x = x0 + col
+            pz = _skylight_sample(heights, windows, 0, y, x)
+            total = 0.0
+            for d in range(len(steps)):
+                ux, uy = steps[d]
+                level, spacing, count = 0, 1.0, 0
+                t = 1.0
+                best = 0.0
+                while t <= max_distance:
+                    px = math.floor(x + 0.5 + t * ux)
+                    py = math.floor(y + 0.5 + t * uy)
+                    if px < 0 or px >= width or py < 0 or py >= height:
+                        break
+                    hz = _skylight_sample(heights, windows, level, py, px)
+                    best = max(best, (hz - pz) / (t * cell))
+                    t += spacing
+                    count += 1
+                    limit = near if level == 0 else near // 2
+                    if count == limit and level < nlevels - 1:
+                        level, spacing, count = level + 1, spacing * 2, 0
+                total += math.atan(best / math.sqrt(1 + best * best))
+            occlusion[row, col] = total
+
+@jit(nopython=True, fastmath=True, cache=True)
+def _skylight_sample(heights, windows, level, y, x):
+    start, wy0, wx0, wh, ww = windows[level]
+    j = min(max((y >> level) - wy0, 0), wh - 1)
+    i = min(max((x >> level) - wx0, 0), ww - 1)
+    return heights[start + j * ww + i]
+
+def _sweep_directions(directions):
+    # A count of directions is turned into the primitive integer steps
+    # whose angles are closest to evenly spaced angles. The longest step
+    # grows with the count, so that 4, 8 and 16 directions give the
+    # rook, bishop and knight moves. If two angles would share a step,
+    # longer steps are allowed until every angle has its own.
+    if directions is None:
+        return np.int32(SWEEP_DIRECTIONS)
+    if not np.isscalar(directions):
+        directions = np.int32(directions)
+        assert directions.ndim == 2 and directions.shape[1] == 2
+        assert np.all(np.any(directions != 0, axis=1)), 'Zero step'
+        unique = np.unique(directions, axis=0)
+        assert len(unique) == len(directions), 'Duplicate directions'
+        return directions
+    count = int(directions)
+    assert count > 0, 'There must be at least one direction'
+    reach = -(-count // 8)
+    while True:
+        steps = _nearest_steps(count, reach)
+        if len(np.unique(steps, axis=0)) == count:
+            return steps
+        reach += 1
+
+def _nearest_steps(count, reach):
+    x, y = np.meshgrid(np.arange(-reach, reach + 1),
+                       np.arange(-reach, reach + 1))
+    x, y = x.ravel(), y.ravel()
+    primitive = [math.gcd(int(a), int(b)) == 1 for a, b in zip(x, y)]
+    x, y = x[primitive], y[primitive]
+    angles = np.arctan2(y, x)
+    steps = []
+    for target in 2 * np.pi * np.arange(count) / count:
+        error = np.abs(np.angle(np.exp(1j * (angles - target))))
+        best = np.lexsort((x * x + y * y, np.round(error, 9)))[0]
+        steps.append((x[best], y[best]))
+    return np.int32(steps)
+
+def _generate_seedpoints(width, height, directions):
+    # Each sweep starts just outside the image and then steps along its
+    # direction. Returns a seed for every sweep of every direction,
+    # along with where each direction starts. A seed is the origin of
+    # the sweep and the number of the first step that lands inside the
+    # image.
+    seedpoints, offsets = [], [0]
+    for direction in directions:
+        if _walks_pixels(*direction):
+            seeds = _walk_seedpoints(width, height, *direction)
+        else:
+            seeds = _step_seedpoints(width, height, *direction)
+        seedpoints.append(seeds)
+        offsets.append(offsets[-1] + len(seeds))
+    return np.int32(np.concatenate(seedpoints)), np.int64(offsets)
+
+def _step_seedpoints(width, height, dx, dy):
+    # For a direction of (ax, ay), the seeds are a strip of ax columns
+    # to the left of the image and a strip of ay rows above it, which
+    # are mirrored for negative directions.
+    sx, sy = np.sign([dx, dy])
+    ax, ay = abs(dx), abs(dy)
+    lx, ly = np.meshgrid(np.arange(-ax, 0), np.arange(-ay, height - ay))
+    tx, ty = np.meshgrid(np.arange(0, width - ax), np.arange(-ay, 0))
+    x = np.concatenate([lx.ravel(), tx.ravel()])
+    y = np.concatenate([ly.ravel(), ty.ravel()])
+    if sx < 0: x = width - x - 1
+    if sy < 0: y = height - y - 1
+    return np.stack([x, y, np.ones(len(x), int)], axis=1)
+
+def _walk_seedpoints(width, height, dx, dy):
+    # Sweeps that walk through every pixel all start one pixel before
+    # the image along the major axis, at every offset along the minor
+    # axis whose line crosses the image. They share the same pattern of
+    # minor steps, so each pixel lies on exactly one of them.
+    transpose = abs(dy) > abs(dx)
+    if transpose:
+        dx, dy, width, height = dy, dx, height, width
+    a, b = abs(dx), abs(dy)
+    minor = lambda t: (t * b + a // 2) // a
+    y = np.arange(-minor(width), height - minor(1))
+    first = np.ones(len(y), int)
+    if b > 0:
+        below = y < 0
+        first[below] = np.maximum(-(-(-y[below] * a - a // 2) // b), 1)
+    x = np.full(len(y), -1)
+    if dx < 0: x = width - x - 1
+    if dy < 0: y = height - y - 1
+    if transpose:
+        x, y = y, x
+    return np.stack([x, y, first], axis=1)
+
+@jit(nopython=True, cache=True)
+def _walks_pixels(dx, dy):
+    # Steps that are longer than one pixel along either axis, such as
+    # knight moves, would skip over nearby occluders. Sweeps along them
+    # visit every pixel on their line instead.
+    return max(abs(dx), abs(dy)) > 1
+
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def _horizon_scan(heights, occlusion, directions, seedpoints, offsets,
+                  nchunks):
+    # Sweeps in the same direction never visit the same pixel, so they
+    # are split into one contiguous chunk per thread. Each chunk has its
+    # own stack, which is large enough for the longest sweep in the
+    # current direction, so memory does not grow with the image area.
+    h, w = heights.shape
+    for d in range(len(directions)):
+        dx, dy = directions[d]
+        pathlen = max(w, h)
+        if not _walks_pixels(dx, dy):
+            if dx != 0: pathlen = min(pathlen, -(-w // abs(dx)))
+            if dy != 0: pathlen = min(pathlen, -(-h // abs(dy)))
+        first, nsweeps = offsets[d], offsets[d + 1] - offsets[d]
+        for chunk in prange(nchunks):
+            steps = np.empty(pathlen + 1, np.int32)
+            elevations = np.empty(pathlen + 1, np.float32)
+            for sweep in range(first + chunk * nsweeps // nchunks,
+                               first + (chunk + 1) * nsweeps // nchunks):
+                i, j, t = seedpoints[sweep]
+                _horizon_sweep(heights, occlusion, steps, elevations,
+                               i, j, t, dx, dy)
+
+@jit(nopython=True, fastmath=True, cache=True)
+def _sweep_point(i, j, t, dx, dy):
+    # Find the pixel that is t steps along a sweep from (i, j). Sweeps
+    # that walk through pixels advance by one pixel along the major
+    # axis, and by a rounded fraction of a pixel along the other.
+    if not _walks_pixels(dx, dy):
+        return i + t * dx, j + t * dy
+    a, b = abs(dx), abs(dy)
+    if a >= b:
+        return i + np.sign(dx) * t, j + np.sign(dy) * ((t * b + a // 2) // a)
+    return i + np.sign(dx) * ((t * a + b // 2) // b), j + np.sign(dy) * t
+
+@jit(nopython=True, fastmath=True, cache=True)
+def _horizon_sweep(heights, occlusion, steps, elevations, i, j, t, dx, dy):
+    # Walk along a single sweep, keeping the convex hull of the terrain
+    # behind the current point in a stack. The top of the stack is the
+    # horizon as seen from the current point. Points on a sweep are
+    # evenly spaced, so each stack entry is just its step number along
+    # the sweep and its elevation.
+    h, w = heights.shape
+    steplen = math.sqrt(dx * dx + dy * dy) / max(w, h)
+    if _walks_pixels(dx, dy):
+        steplen /= max(abs(dx), abs(dy))
+    x, y = _sweep_point(i, j, t - 1, dx, dy)
+    x, y = min(max(0, x), w-1), min(max(0, y), h-1)
+
+    stack_top = 0
+    steps[0] = t - 1
+    elevations[0] = heights[y][x]
+
+    # Sweeps that walk through pixels track the rounding error of the
+    # minor axis, so that each step is a few additions.
+    walk = _walks_pixels(dx, dy)
+    major, minor = max(abs(dx), abs(dy)), min(abs(dx), abs(dy))
+    sx, sy = np.sign(dx), np.sign(dy)
+    xmajor = abs(dx) >= abs(dy)
+    error = (t * minor + major // 2) % major
+    x, y = _sweep_point(i, j, t, dx, dy)
+    while x >= 0 and x < w and y >= 0 and y < h:
+
+        pz = heights[y][x]
+
+        while stack_top > 0:
+            s1 = (elevations[stack_top] - pz) / (t - steps[stack_top])
+            s2 = (elevations[stack_top - 1] - pz) / \
+                (t - steps[stack_top - 1])
+            if s1 >= s2: break
+            stack_top -= 1
+
+        hz = elevations[stack_top] - pz
+        hd = (t - steps[stack_top]) * steplen
+        stack_top += 1
+        steps[stack_top] = t
+        elevations[stack_top] = pz
+
+        slope = hz / math.sqrt(hd * hd + hz * hz)
+        occlusion[y][x] += math.atan(max(slope, 0))
+
+        t += 1
+        if not walk:
+            x += dx
+            y += dy
+            continue
+        error += minor
+        carry = error >= major
+        if carry: error -= major
+        if xmajor:
+            x += sx
+            if carry: y += sy
+        else:
+            y += sy
+            if carry: x += sx
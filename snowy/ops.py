@@ -1,57 +1,68 @@
 """Define add_border etc."""
 
 from snowy.io import *
-from numba import guvectorize
+from snowy.io import _float_dtype, _prepare_out
+from numba import guvectorize, jit, prange
+from numba.typed import List
 import numpy as np
 
 def add_left(image: np.ndarray, T=2, V=0) -> np.ndarray:
     height, width, nchan = image.shape
     newshape = height, width + T, nchan
-    result = np.full(newshape, np.float64(V))
+    result = np.full(newshape, V, dtype=_float_dtype(image))
     np.copyto(result[:,T:], image)
     return result
 
 def add_right(image: np.ndarray, T=2, V=0) -> np.ndarray:
     height, width, nchan = image.shape
     newshape = height, width + T, nchan
-    result = np.full(newshape, np.float64(V))
+    result = np.full(newshape, V, dtype=_float_dtype(image))
     np.copyto(result[:,:-T], image)
     return result
 
 def add_top(image: np.ndarray, T=2, V=0) -> np.ndarray:
     height, width, nchan = image.shape
     newshape = height + T, width, nchan
-    result = np.full(newshape, np.float64(V))
+    result = np.full(newshape, V, dtype=_float_dtype(image))
     np.copyto(result[T:,:], image)
     return result
 
 def add_bottom(image: np.ndarray, T=2, V=0) -> np.ndarray:
     height, width, nchan = image.shape
     newshape = height + T, width, nchan
-    result = np.full(newshape, np.float64(V))
+    result = np.full(newshape, V, dtype=_float_dtype(image))
     np.copyto(result[:-T,:], image)
     return result
 
-def add_border(image: np.ndarray, width=2, value=0, sides='ltrb'):
+def add_border(image: np.ndarray, width=2, value=0, sides='ltrb',
+               out=None):
     """Extend the size of an image by adding borders.
 
     <p>
     The <code>sides</code> argument defaults to
     <code>"LTRB"</code>, which enables borders for all four sides: Left,
     Top, Right, and Bottom. This can be used to select which borders you
-    wish to add.
+    wish to add. The result is written into <code>out</code> when it
+    is provided.
     </p>
 
     """
-    result = image
     sides = sides.upper()
-    if 'L' in sides: result = add_left(result, width, value)
-    if 'T' in sides: result = add_top(result, width, value)
-    if 'R' in sides: result = add_right(result, width, value)
-    if 'B' in sides: result = add_bottom(result, width, value)
+    nrows, ncols, nchan = image.shape
+    left = width if 'L' in sides else 0
+    top = width if 'T' in sides else 0
+    right = width if 'R' in sides else 0
+    bottom = width if 'B' in sides else 0
+    newshape = nrows + top + bottom, ncols + left + right, nchan
+    result = _prepare_out(out, newshape, _float_dtype(image))
+    result[:top] = value
+    result[top + nrows:] = value
+    result[top:top + nrows, :left] = value
+    result[top:top + nrows, left + ncols:] = value
+    np.copyto(result[top:top + nrows, left:left + ncols], image)
     return result
 
-def hstack(images, border_width=2, border_value=0):
+def hstack(images, border_width=2, border_value=0, out=None):
     """Horizontally concatenate a list of images with a border.
     
     This is similar to numpy's <code>hstack</code> except that it adds
@@ -60,15 +71,10 @@ def hstack(images, border_width=2, border_value=0):
     <code>border_value</code> arguments. See also <a href="#vstack">
     vstack</a>.
     """
-    if border_width == 0: return np.hstack(images)
-    T, V = border_width, border_value
-    result = []
-    for image in images[:-1]:
-        result.append(add_border(image, T, V, 'LTB'))
-    result.append(add_border(images[-1], T, V))
-    return np.hstack(result)
-
-def vstack(images, border_width=2, border_value=0):
+    if border_width == 0 and out is None: return np.hstack(images)
+    return _stack(images, 1, border_width, border_value, out)
+
+def vstack(images, border_width=2, border_value=0, out=None):
     """Vertically concatenate a list of images with a border.
     
     This is similar to numpy's <code>vstack</code> except that it adds
@@ -77,13 +83,37 @@ def vstack(images, border_width=2, border_value=0):
     <code>border_value</code> arguments. See also <a href="#hstack">
     hstack</a>.
     """
-    if border_width == 0: return np.vstack(images)
-    T, V = border_width, border_value
-    result = []
-    for image in images[:-1]:
-        result.append(add_border(image, T, V, 'LTR'))
-    result.append(add_border(images[-1], T, V))
-    return np.vstack(result)
+    if border_width == 0 and out is None: return np.vstack(images)
+    return _stack(images, 0, border_width, border_value, out)
+
+def _stack(images, axis, T, V, out):
+    # Allocate the entire bordered result up front, fill only its
+    # borders, and copy each image into place exactly once. To handle
+    # both directions with the same code, the vertical case works with
+    # transposed views, so that images are always laid out along the
+    # second axis of "canvas".
+    across = 1 - axis
+    extent = images[0].shape[across]
+    assert all(image.shape[across] == extent for image in images), \
+        'Images must have the same size across the stacking axis'
+    length = sum(image.shape[axis] for image in images)
+    newshape = [0, 0, images[0].shape[2]]
+    newshape[axis] = length + T * (len(images) + 1)
+    newshape[across] = extent + 2 * T
+    single = all(image.dtype == np.float32 for image in images)
+    result = _prepare_out(out, newshape, np.float32 if single else np.float64)
+    canvas = result if axis == 1 else np.swapaxes(result, 0, 1)
+    canvas[:T] = V
+    canvas[T + extent:] = V
+    x = 0
+    for image in images:
+        if axis == 0: image = np.swapaxes(image, 0, 1)
+        canvas[T:T + extent, x:x + T] = V
+        x += T
+        np.copyto(canvas[T:T + extent, x:x + image.shape[1]], image)
+        x += image.shape[1]
+    canvas[T:T + extent, x:] = V
+    return result
 
 def unitize(img):
     """Remap the values so that they span the range from 0 to +1."""
@@ -94,64 +124,171 @@ def gradient(img):
     nx, ny = np.gradient(unshape(img))
     return reshape(nx), reshape(ny)
 
-def rotate(source: np.ndarray, degrees) -> np.ndarray:
-    """Rotate image counter-clockwise by a multiple of 90 degrees."""
+def rotate(source: np.ndarray, degrees, out=None) -> np.ndarray:
+    """Rotate image counter-clockwise by a multiple of 90 degrees.
+
+    The result is written into <code>out</code> when it is provided.
+    For 180 degrees, this can be the source image itself.
+    """
     assert len(source.shape) == 3, 'Shape is not rows x cols x channels'
-    assert source.dtype == np.float, 'Images must be doubles.'
+    assert source.dtype in (np.float32, np.float64), 'Images must be floats.'
     h, w, c = source.shape
     degrees %= 360
     if degrees == 90:
-        result = np.empty([w, h, c])
-        rotate90(result, source)
+        result = _prepare_out(out, [w, h, c], source.dtype)
+        rotate90(result, _unalias(result, source))
     elif degrees == 180:
-        result = np.empty([h, w, c])
-        rotate180(result, source)
+        result = _prepare_out(out, [h, w, c], source.dtype)
+        if _is_inplace(result, source):
+            jit_rotate180_inplace(result)
+        else:
+            rotate180(result, _unalias(result, source))
     elif degrees == 270:
-        result = np.empty([w, h, c])
-        rotate270(result, source)
+        result = _prepare_out(out, [w, h, c], source.dtype)
+        rotate270(result, _unalias(result, source))
     else:
         assert False, 'Angle must be a multiple of 90.'
     return result
 
-def hflip(source: np.ndarray) -> np.ndarray:
-    """Horizontally mirror the given image."""
+def hflip(source: np.ndarray, out=None) -> np.ndarray:
+    """Horizontally mirror the given image.
+
+    The result is written into <code>out</code> when it is provided,
+    which can be the source image itself.
+    """
     assert len(source.shape) == 3, 'Shape is not rows x cols x channels'
-    assert source.dtype == np.float, 'Images must be doubles.'
-    h, w, c = source.shape
-    result = np.empty([h, w, c])
-    jit_hflip(result, source)
+    assert source.dtype in (np.float32, np.float64), 'Images must be floats.'
+    result = _prepare_out(out, source.shape, source.dtype)
+    if _is_inplace(result, source):
+        jit_hflip_inplace(result)
+    else:
+        jit_hflip(result, _unalias(result, source))
     return result
 
-def vflip(source: np.ndarray) -> np.ndarray:
-    """Vertically mirror the given image."""
+def vflip(source: np.ndarray, out=None) -> np.ndarray:
+    """Vertically mirror the given image.
+
+    The result is written into <code>out</code> when it is provided,
+    which can be the source image itself.
+    """
     assert len(source.shape) == 3, 'Shape is not rows x cols x channels'
-    assert source.dtype == np.float, 'Images must be doubles.'
-    h, w, c = source.shape
-    result = np.empty([h, w, c])
-    jit_vflip(result, source)
+    assert source.dtype in (np.float32, np.float64), 'Images must be floats.'
+    result = _prepare_out(out, source.shape, source.dtype)
+    if _is_inplace(result, source):
+        jit_vflip_inplace(result)
+    else:
+        jit_vflip(result, _unalias(result, source))
     return result
 
-def compose(dst: np.ndarray, src: np.ndarray) -> np.ndarray:
-    """Compose a source image with alpha onto a destination image."""
-    a, b = ensure_alpha(src), ensure_alpha(dst)
-    alpha = extract_alpha(a)
-    result = b * (1.0 - alpha) + a * alpha
-    if dst.shape[2] == 3:
-        return extract_rgb(result)
+def compose(dst: np.ndarray, src: np.ndarray, out=None,
+            offset=(0, 0)) -> np.ndarray:
+    """Compose a source image with alpha onto a destination image.
+
+    The source can be smaller than the destination, in which case its
+    upper-left corner is placed at the given (x, y) offset. The result
+    is written into <code>out</code> when it is provided, which can be
+    the destination image itself.
+    """
+    return _compose(dst, src, out, offset, False)
+
+def compose_premultiplied(dst: np.ndarray, src: np.ndarray, out=None,
+                          offset=(0, 0)):
+    """Draw an image with premultiplied alpha over the destination.
+
+    See <a href="#compose">compose</a> for a description of the
+    <code>out</code> and <code>offset</code> arguments.
+    """
+    return _compose(dst, src, out, offset, True)
+
+def compose_many(dst: np.ndarray, layers, offsets=None,
+                 premultiplied=False, out=None) -> np.ndarray:
+    """Compose a list of images with alpha onto a destination image.
+
+    This is equivalent to calling <a href="#compose">compose</a> once
+    per layer, in order, but visits each row of the destination only
+    once. The optional <code>offsets</code> is a list of (x, y) pairs,
+    one per layer.
+    """
+    assert len(dst.shape) == 3, 'Shape is not rows x cols x channels'
+    assert dst.shape[2] in (3, 4), 'Destination must be RGB or RGBA'
+    if offsets is None: offsets = [(0, 0)] * len(layers)
+    assert len(offsets) == len(layers), 'Need one offset per layer'
+    result = _prepare_out(out, dst.shape, _float_dtype(dst))
+    inplace = _is_inplace(result, dst)
+    if not inplace: dst = _unalias(result, dst)
+    sources = List()
+    for layer in layers:
+        assert len(layer.shape) == 3, 'Shape is not rows x cols x channels'
+        assert layer.shape[2] in (3, 4), 'Layers must be RGB or RGBA'
+        layer = _unalias(result, layer)
+        sources.append(np.ascontiguousarray(layer, dtype=result.dtype))
+    offsets = np.int64(np.reshape(offsets, (len(layers), 2)))
+    if len(layers) == 0:
+        if not inplace: np.copyto(result, dst)
+        return result
+    jit_compose_many(result, dst, sources, offsets, premultiplied, inplace)
     return result
 
-def compose_premultiplied(dst: np.ndarray, src: np.ndarray):
-    """Draw an image with premultiplied alpha over the destination."""
-    a, b = ensure_alpha(src), ensure_alpha(dst)
-    alpha = extract_alpha(a)
-    result = b * (1.0 - alpha) + a
-    if dst.shape[2] == 3:
-        return extract_rgb(result)
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def jit_compose_many(result, dst, sources, offsets, premultiplied, inplace):
+    for row in prange(dst.shape[0]):
+        if not inplace:
+            result[row] = dst[row]
+        for layer in range(len(sources)):
+            x, y = offsets[layer, 0], offsets[layer, 1]
+            _blend_row(result[row], sources[layer], row - y, x, premultiplied)
+
+def _compose(dst, src, out, offset, premultiplied):
+    assert len(dst.shape) == 3, 'Shape is not rows x cols x channels'
+    assert len(src.shape) == 3, 'Shape is not rows x cols x channels'
+    assert dst.shape[2] in (3, 4), 'Destination must be RGB or RGBA'
+    assert src.shape[2] in (3, 4), 'Source must be RGB or RGBA'
+    result = _prepare_out(out, dst.shape, _float_dtype(dst))
+    inplace = _is_inplace(result, dst)
+    if not inplace: dst = _unalias(result, dst)
+    src = _unalias(result, src)
+    x, y = offset
+    jit_compose(result, dst, src, int(x), int(y), premultiplied, inplace)
     return result
 
+@jit(nopython=True, fastmath=True, parallel=True, cache=True)
+def jit_compose(result, dst, src, x, y, premultiplied, inplace):
+    for row in prange(dst.shape[0]):
+        if not inplace:
+            result[row] = dst[row]
+        _blend_row(result[row], src, row - y, x, premultiplied)
+
+@jit(nopython=True, fastmath=True, cache=True)
+def _blend_row(target, src, srow, x, premultiplied):
+    # Blend one row of the source over a row of the target, where the
+    # source is shifted to the right by x. If the source has no alpha
+    # channel it is treated as opaque, and if the target has an alpha
+    # channel but the source does not, the source alpha is 1.
+    if srow < 0 or srow >= src.shape[0]:
+        return
+    ncols, nchan = target.shape
+    scols, schan = src.shape[1], src.shape[2]
+    for col in range(max(x, 0), min(x + scols, ncols)):
+        scol = col - x
+        alpha = src[srow, scol, 3] if schan == 4 else 1.0
+        for c in range(nchan):
+            value = src[srow, scol, c] if c < schan else 1.0
+            if not premultiplied: value *= alpha
+            target[col, c] = target[col, c] * (1.0 - alpha) + value
+
+def _is_inplace(result, source):
+    # Determine if the result is exactly the same view as the source.
+    return result.__array_interface__ == source.__array_interface__
+
+def _unalias(result, source):
+    # Copy the source if it overlaps with the result, for operations
+    # that cannot be performed in place.
+    return source.copy() if np.may_share_memory(result, source) else source
+
 SIG0 = "void(f8[:,:,:], f8[:,:,:])"
 SIG1 = "(r,c,d),(c,r,d)"
-@guvectorize([SIG0], SIG1, target='parallel', cache=True)
+SIG2 = "void(f4[:,:,:], f4[:,:,:])"
+@guvectorize([SIG0, SIG2], SIG1, target='parallel', cache=True)
 def rotate90(result, source):
     nrows, ncols, nchan = source.shape
     for row in range(nrows):
@@ -162,7 +299,8 @@ def rotate90(result, source):
 
 SIG0 = "void(f8[:,:,:], f8[:,:,:])"
 SIG1 = "(r,c,d),(r,c,d)"
-@guvectorize([SIG0], SIG1, target='parallel', cache=True)
+SIG2 = "void(f4[:,:,:], f4[:,:,:])"
+@guvectorize([SIG0, SIG2], SIG1, target='parallel', cache=True)
 def rotate180(result, source):
     nrows, ncols, nchan = source.shape
     for row in range(nrows):
@@ -173,7 +311,8 @@ def rotate180(result, source):
 
 SIG0 = "void(f8[:,:,:], f8[:,:,:])"
 SIG1 = "(r,c,d),(c,r,d)"
-@guvectorize([SIG0], SIG1, target='parallel', cache=True)
+SIG2 = "void(f4[:,:,:], f4[:,:,:])"
+@guvectorize([SIG0, SIG2], SIG1, target='parallel', cache=True)
 def rotate270(result, source):
     nrows, ncols, nchan = source.shape
     for row in range(nrows):
@@ -184,7 +323,8 @@ def rotate270(result, source):
 
 SIG0 = "void(f8[:,:,:], f8[:,:,:])"
 SIG1 = "(r,c,d),(r,c,d)"
-@guvectorize([SIG0], SIG1, target='parallel', cache=True)
+SIG2 = "void(f4[:,:,:], f4[:,:,:])"
+@guvectorize([SIG0, SIG2], SIG1, target='parallel', cache=True)
 def jit_hflip(result, source):
     nrows, ncols, nchan = source.shape
     for row in range(nrows):
@@ -195,7 +335,8 @@ def jit_hflip(result, source):
 
 SIG0 = "void(f8[:,:,:], f8[:,:,:])"
 SIG1 = "(r,c,d),(r,c,d)"
-@guvectorize([SIG0], SIG1, target='parallel', cache=True)
+SIG2 = "void(f4[:,:,:], f4[:,:,:])"
+@guvectorize([SIG0, SIG2], SIG1, target='parallel', cache=True)
 def jit_vflip(result, source):
     nrows, ncols, nchan = source.shape
     for row in range(nrows):
@@ -203,3 +344,33 @@ def jit_vflip(result, source):
             for chan in range(nchan):
                 v = source[row][col][chan]
                 result[-row-1][col][chan] = v
+
+@jit(nopython=True, fastmath=True, cache=True)
+def jit_hflip_inplace(image):
+    nrows, ncols, nchan = image.shape
+    for row in range(nrows):
+        for col in range(ncols // 2):
+            for chan in range(nchan):
+                v = image[row][col][chan]
+                image[row][col][chan] = image[row][-col-1][chan]
+                image[row][-col-1][chan] = v
+
+@jit(nopython=True, fastmath=True, cache=True)
+def jit_vflip_inplace(image):
+    nrows, ncols, nchan = image.shape
+    for row in range(nrows // 2):
+        for col in range(ncols):
+            for chan in range(nchan):
+                v = image[row][col][chan]
+                image[row][col][chan] = image[-row-1][col][chan]
+                image[-row-1][col][chan] = v
+
+@jit(nopython=True, fastmath=True, cache=True)
+def jit_rotate180_inplace(image):
+    nrows, ncols, nchan = image.shape
+    for index in range(nrows * ncols // 2):
+        row, col = index // ncols, index % ncols
+        for chan in range(nchan):
+            v = image[row][col][chan]
+            image[row][col][chan] = image[-row-1][-col-1][chan]
+            image[-row-1][-col-1][chan] = v
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+"""
+Compare the gather and scatter resampling methods at a variety of zoom
+factors. Run this from the repo root.
+"""
+
+import sys
+sys.path.append('.')
+
+import timeit
+import snowy
+import numpy as np
+from snowy.filtering import resample
+
+ZOOMS = [2, 4, 16]
+LARGE = 2048
+
+def benchmark(source, width, height, method):
+    filter = snowy.MITCHELL if width > source.shape[1] else snowy.LANCZOS
+    resize = lambda: resample(source, width, height, filter, 1,
+                              False, False, method)
+    resize()
+    return min(timeit.repeat(resize, number=1, repeat=3))
+
+def run(label, source, width, height):
+    scatter = benchmark(source, width, height, 'scatter')
+    gather = benchmark(source, width, height, 'gather')
+    print(f'{label:>14} {scatter:9.4f}s {gather:9.4f}s '
+          f'{scatter / gather:7.2f}x')
+
+print(f'{"":>14} {"scatter":>10} {"gather":>10} {"speedup":>8}')
+large = np.random.RandomState(42).rand(LARGE, LARGE, 4)
+for zoom in ZOOMS:
+    run(f'minify {zoom}x', large, LARGE // zoom, LARGE // zoom)
+for zoom in ZOOMS:
+    small = large[:LARGE // zoom, :LARGE // zoom]
+    run(f'magnify {zoom}x', small, LARGE, LARGE)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+"""
+Report the error and speed of FAST_GAUSSIAN relative to GAUSSIAN for a
+range of blur radii. Run this from the repo root. Radii below 3 are
+too small for box filters, so FAST_GAUSSIAN uses GAUSSIAN for them and
+reports no error.
+"""
+
+import sys
+sys.path.append('.')
+
+import timeit
+import snowy
+import numpy as np
+
+RADII = [1, 2, 3, 4, 8, 16, 32, 64]
+SIZE = 1024
+
+def measure(image, filter, radius, wrap):
+    blur = lambda: snowy.blur(image, filter, radius, wrap, wrap)
+    result = blur()
+    return result, min(timeit.repeat(blur, number=1, repeat=2))
+
+image = snowy.generate_noise(SIZE, SIZE, frequency=8, seed=42,
+                             wrapx=True, wrapy=True)
+image = np.dstack([image, np.sign(image), image * image])
+
+print(f'{"radius":>6} {"wrap":>5} {"max error":>10} {"rms error":>10} '
+      f'{"gaussian":>9} {"fast":>9}')
+for radius in RADII:
+    for wrap in [False, True]:
+        gold, slow = measure(image, snowy.GAUSSIAN, radius, wrap)
+        fast, quick = measure(image, snowy.FAST_GAUSSIAN, radius, wrap)
+        error = np.abs(gold - fast)
+        rms = np.sqrt(np.mean(error * error))
+        print(f'{radius:6} {str(wrap):>5} {np.amax(error):10.5f} '
+              f'{rms:10.6f} {slow:8.3f}s {quick:8.3f}s')
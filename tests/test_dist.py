@@ -102,3 +102,118 @@ def test_tweet():
 
     sn.show(sn.resize(im, height=100, wrapx=True))
     sn.show(sn.resize(np.hstack([im, im]), height=200, wrapx=True))
+
+def test_wrapped_udf():
+    mask = snowy.generate_noise(60, 40, 4, seed=1, wrapx=True) > 0.5
+    tiled = np.hstack([mask, mask, mask])
+    tiled = np.vstack([tiled, tiled, tiled])
+    gold = snowy.generate_udf(tiled)[40:80,60:120]
+    udf = snowy.generate_udf(mask, wrapx=True, wrapy=True)
+    assert udf.shape == mask.shape
+    assert np.allclose(udf, gold)
+
+def test_fused_sdf():
+    mask = snowy.generate_noise(60, 40, 4, seed=1) > 0.2
+    gold = snowy.generate_udf(mask) - snowy.generate_udf(mask == 0.0)
+    assert np.allclose(snowy.generate_sdf(mask), gold)
+    sdf = snowy.generate_sdf(mask, max_distance=4, dtype=np.float32)
+    assert sdf.dtype == np.float32
+    assert np.allclose(sdf, np.clip(gold, -4, 4))
+    sdf = snowy.generate_sdf(mask, max_distance=4, dtype=np.uint8)
+    assert sdf.dtype == np.uint8
+    assert np.allclose(sdf, np.round((np.clip(gold, -4, 4) + 4) * 255 / 8))
+
+def test_narrow_band():
+    mask = np.zeros((500, 700, 1), dtype=bool)
+    mask[[5, 60, 250, 497], [690, 3, 300, 10]] = True
+    mask[200:230, 400:480] = True
+    for wrap in [False, True]:
+        gold = np.minimum(snowy.generate_udf(mask, wrap, wrap), 5)
+        udf = snowy.generate_udf(mask, wrap, wrap, max_distance=5)
+        assert np.allclose(udf, gold)
+        gold = np.clip(snowy.generate_sdf(mask, wrap, wrap), -5, 5)
+        sdf = snowy.generate_sdf(mask, wrap, wrap, max_distance=5)
+        assert np.allclose(sdf, gold)
+
+def test_wide_cpcf():
+    mask = np.zeros((3, 70000, 1), dtype=bool)
+    mask[1, 69000] = True
+    cpcf = snowy.generate_cpcf(mask)
+    assert cpcf.dtype == np.int32
+    assert tuple(cpcf[2, 69990]) == (69000, 1)
+
+def test_streamed(tmp_path):
+    mask = snowy.generate_noise(150, 100, 4, seed=1) > 0.2
+    source = np.memmap(tmp_path / 'mask', bool, 'w+', shape=mask.shape)
+    source[:] = mask
+    for wrap in [False, True]:
+        out = np.memmap(tmp_path / 'sdf', np.float32, 'w+', shape=mask.shape)
+        snowy.generate_sdf_streamed(source, out, wrap, wrap, strip_size=16)
+        assert np.allclose(out, snowy.generate_sdf(mask, wrap, wrap))
+        out = np.memmap(tmp_path / 'udf', np.float64, 'w+', shape=mask.shape)
+        snowy.generate_udf_streamed(source, out, wrap, wrap, strip_size=16)
+        assert np.allclose(out, snowy.generate_udf(mask, wrap, wrap))
+        out = np.memmap(tmp_path / 'tiled', np.float32, 'w+', shape=mask.shape)
+        reader = lambda y0, y1, x0, x1: mask[y0:y1,x0:x1]
+        snowy.generate_sdf_streamed(reader, out, wrap, wrap, max_memory=5000)
+        assert np.allclose(out, snowy.generate_sdf(mask, wrap, wrap))
+
+def test_volume():
+    volume = np.random.default_rng(1).random((9, 10, 11)) < 0.02
+    seeds = np.argwhere(volume)
+    coords = np.indices(volume.shape).reshape(3, -1).T
+    for wrap in [False, True]:
+        delta = np.abs(coords[:,None,:] - seeds[None,:,:])
+        if wrap:
+            delta = np.minimum(delta, np.array(volume.shape) - delta)
+        gold = np.sqrt(np.amin(np.sum(delta ** 2, axis=2), axis=1))
+        udf = snowy.generate_udf_volume(volume, wrap, wrap, wrap)
+        assert np.allclose(udf.ravel(), gold)
+    sdf = snowy.generate_sdf_volume(volume)
+    assert np.all(sdf[volume] < 0) and np.all(sdf[~volume] > 0)
+
+def test_voronoi():
+    mask = np.random.default_rng(1).random((120, 160, 1)) < 0.01
+    colors = snowy.generate_noise(160, 120, 4, seed=1)
+    colors = np.dstack([colors, -colors, colors * 2])
+    gold = snowy.dereference_coords(colors, snowy.generate_cpcf(mask))
+    assert np.array_equal(snowy.generate_voronoi(mask, colors), gold)
+
+def test_spacing():
+    mask = np.random.default_rng(2).random((40, 50, 1)) < 0.01
+    sx = np.linspace(0.5, 2.0, 40)
+    seeds = np.argwhere(mask[:,:,0])
+    y, x = np.indices(mask.shape[:2])
+    dy = (y[:,:,None] - seeds[:,0]) * 3.0
+    dx = (x[:,:,None] - seeds[:,1]) * sx[:,None,None]
+    gold = np.sqrt(np.amin(dx ** 2 + dy ** 2, axis=2))
+    udf = snowy.generate_udf(mask, spacing=(sx, 3.0))
+    assert np.allclose(udf[:,:,0], gold)
+    udf = snowy.generate_udf(mask, max_distance=4, spacing=(sx, 3.0))
+    assert np.allclose(udf[:,:,0], np.minimum(gold, 4))
+    sdf = snowy.generate_sdf(mask, spacing=(sx, 3.0))
+    assert np.allclose(sdf[~mask], gold[~mask[:,:,0]])
+
+def test_update_sdf():
+    mask = snowy.generate_noise(300, 200, 4, seed=1) > 0.3
+    sdf = snowy.generate_sdf(mask)
+    clamped = snowy.generate_sdf(mask, max_distance=6)
+    mask[50:60, 100:130] = ~mask[50:60, 100:130]
+    mask[150:152, 10:12] = True
+    bounds = 10, 50, 130, 152
+    gold = snowy.generate_sdf(mask)
+    assert np.allclose(snowy.update_sdf(sdf, mask, bounds), gold)
+    snowy.update_sdf(clamped, mask, bounds, max_distance=6, out=clamped)
+    assert np.allclose(clamped, np.clip(gold, -6, 6))
+    mask[:] = False
+    mask[5, 5] = True
+    sdf = snowy.generate_sdf(mask)
+    mask[5, 5] = False
+    mask[190, 290] = True
+    sdf = snowy.update_sdf(sdf, mask, (5, 5, 291, 191))
+    assert np.allclose(sdf, snowy.generate_sdf(mask))
+    # Old distances of zero must still let the search window grow.
+    mask = np.zeros((64, 64, 1), bool)
+    mask[30, 5] = True
+    sdf = snowy.update_sdf(np.zeros((64, 64, 1)), mask, (5, 30, 6, 31))
+    assert sdf[30, 5, 0] < 0
@@ -83,3 +83,9 @@ def test_gamma():
     small = snowy.resize(dalai_lama, height=32)
     snowy.export(small, path('small_dalai_lama.png'))
     snowy.show(small)
+
+def test_float32():
+    ground = snowy.load(path('../docs/ground.jpg'), dtype=np.float32)
+    assert ground.dtype == np.float32
+    gold = snowy.load(path('../docs/ground.jpg'))
+    assert np.allclose(ground, gold, atol=1e-5)
@@ -79,3 +79,87 @@ def test_normals():
     island_strip = sn.resize(sn.hstack([occlusion, normals, df, albedo]), height=256)
     sn.save(island_strip, 'docs/island_strip.png')
     sn.show(island_strip)
+
+def test_skylight():
+    flat = np.zeros([30, 40, 1])
+    assert np.allclose(sn.compute_skylight(flat), 1)
+    pit = flat.copy()
+    pit[10:20, 10:20] = -1
+    skylight = sn.compute_skylight(pit)
+    assert skylight.shape == pit.shape
+    assert skylight[15, 15, 0] < 1 and skylight[0, 0, 0] == 1
+
+def test_skylight_directions():
+    isle = sn.resize(create_island(10), 150, 100)
+    gold = sn.compute_skylight(isle)
+    assert np.allclose(sn.compute_skylight(isle, directions=16), gold)
+    assert len(sn.lighting._sweep_directions(20)) == 20
+    preview = sn.compute_skylight(isle, directions=4)
+    assert np.abs(preview - gold).mean() < 0.1
+    passes = list(sn.compute_skylight_progressive(isle, 32, batch_size=8))
+    assert len(passes) == 4
+    assert np.allclose(passes[-1], sn.compute_skylight(isle, directions=32))
+
+def test_skylight_tiled():
+    isle = sn.resize(create_island(10), 150, 100)
+    gold = sn.compute_skylight(isle)
+    tiled = sn.compute_skylight_tiled(isle, 200, tile_size=64)
+    assert tiled.shape == isle.shape
+    assert np.abs(tiled - gold).mean() < 0.05
+    near = sn.compute_skylight_tiled(isle, 8, tile_size=64)
+    assert np.all(near >= tiled - 1e-9)
+
+def test_normals_options():
+    ramp = sn.reshape(np.tile(np.arange(8.0), [6, 1]))
+    normals = sn.compute_normals(ramp, central=True, spacing=(1, 1))
+    assert normals.shape == (6, 8, 3)
+    assert np.allclose(normals, [-np.sqrt(0.5), 0, np.sqrt(0.5)])
+    packed = sn.compute_normals(np.float32(ramp), wrapy=True, dtype=np.uint8)
+    assert packed.shape == (6, 7, 3) and packed.dtype == np.uint8
+    assert sn.compute_normals(np.float32(ramp)).dtype == np.float32
+    assert sn.compute_normals(ramp, dtype='uint8').dtype == np.uint8
+    assert sn.compute_normals(ramp[:1]).shape == (0, 7, 3)
+
+def test_skylight_tiled_bounds(tmp_path):
+    isle = sn.resize(create_island(10), 150, 100)
+    assert sn.generate_max_pyramid(isle, 16) == []
+    shapes = [(50, 75, 1), (25, 38, 1), (13, 19, 1)]
+    levels = [np.memmap(tmp_path / str(n), np.float32, 'w+', shape=shape)
+              for n, shape in enumerate(shapes)]
+    sn.generate_max_pyramid(isle, 100, out=levels)
+    assert np.isclose(levels[-1].max(), isle.max())
+    gold = sn.compute_skylight_tiled(isle, 100, tile_size=32)
+    halves = np.memmap(tmp_path / 'out', np.float64, 'w+', shape=isle.shape)
+    for bounds in [(0, 0, 150, 37), (0, 37, 150, 100)]:
+        sn.compute_skylight_tiled(isle, 100, tile_size=32, out=halves,
+                                  bounds=bounds, pyramid=levels)
+    assert np.allclose(halves, gold)
+
+def dense_skylight(elevation, count):
+    # Brute-force reference that marches a ray from every pixel in each
+    # of count directions, sampling every half pixel.
+    el = elevation[:,:,0]
+    height, width = el.shape
+    y, x = np.mgrid[0:height, 0:width]
+    occlusion = np.zeros(el.shape)
+    for angle in 2 * np.pi * np.arange(count) / count:
+        best = np.zeros(el.shape)
+        inside = np.ones(el.shape, bool)
+        for t in np.arange(0.5, max(width, height) * 1.5, 0.5):
+            px = np.floor(x + 0.5 + t * np.cos(angle)).astype(int)
+            py = np.floor(y + 0.5 + t * np.sin(angle)).astype(int)
+            inside &= (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            if not inside.any(): break
+            px, py = np.clip(px, 0, width - 1), np.clip(py, 0, height - 1)
+            dist = np.maximum(np.hypot(px - x, py - y), 1) / max(width, height)
+            tan = np.where(inside, (el[py, px] - el) / dist, 0)
+            best = np.maximum(best, tan)
+        occlusion += np.arctan(best / np.sqrt(1 + best * best))
+    return sn.reshape(np.clip(1 - occlusion * (4 / np.pi / count), 0, 1))
+
+def test_skylight_convergence():
+    isle = sn.resize(create_island(10), 64, 48)
+    gold = dense_skylight(isle, 128)[4:-4,4:-4]
+    errors = [np.abs(sn.compute_skylight(isle, directions=n)[4:-4,4:-4] -
+                     gold).mean() for n in (8, 16, 32, 64)]
+    assert all(b <= a for a, b in zip(errors, errors[1:]))
@@ -90,3 +90,144 @@ def test_tileable_distance():
     sdf -= get_contour(.90, .95)
 
     snowy.show(snowy.resize(np.hstack([sdf, sdf, sdf, sdf]), height=300))
+
+def test_cached_ops():
+    n = snowy.generate_noise(64, 32, frequency=4, seed=42)
+    a = snowy.resize(n, 16, 8)
+    b = snowy.resize(n, 16, 8)
+    assert np.array_equal(a, b)
+    ops = snowy.filtering.create_ops(16, 64, snowy.LANCZOS, 1, False)
+    assert ops is snowy.filtering.create_ops(16, 64, snowy.LANCZOS, 1, False)
+    assert ops.sindices.dtype == np.int32
+    sums = np.bincount(ops.tindices, ops.fweights)
+    assert np.allclose(sums, 1.0)
+
+def test_scalar_filter():
+    n = snowy.generate_noise(64, 32, frequency=4, seed=42)
+    def tent(x):
+        return max(0.0, 1.0 - x) if x < 1 else 0.0
+    scalar = snowy.resize(n, 16, 8, filter=snowy.filtering.Filter(tent, 1))
+    assert np.allclose(scalar, snowy.resize(n, 16, 8, filter=snowy.TRIANGLE))
+
+def test_gather():
+    n = snowy.generate_noise(60, 40, frequency=4, seed=42)
+    resample = snowy.filtering.resample
+    for filter in [snowy.LANCZOS, snowy.GAUSSIAN, snowy.NEAREST]:
+        for width, height in [(15, 10), (180, 120), (7, 3)]:
+            for wrap in [False, True]:
+                args = width, height, filter, 2, wrap, wrap
+                a = resample(n, *args, method='scatter')
+                b = resample(n, *args, method='gather')
+                assert np.allclose(a, b)
+
+def test_fast_gaussian():
+    n = snowy.generate_noise(200, 100, frequency=4, seed=42, wrapx=True)
+    for wrap in [False, True]:
+        gold = snowy.blur(n, snowy.GAUSSIAN, 8, wrap, wrap)
+        fast = snowy.blur(n, snowy.FAST_GAUSSIAN, 8, wrap, wrap)
+        assert fast.shape == gold.shape
+        assert np.sqrt(np.mean((gold - fast) ** 2)) < 0.01
+    small = snowy.blur(n, snowy.FAST_GAUSSIAN, 1)
+    assert np.allclose(small, snowy.blur(n, snowy.GAUSSIAN, 1))
+    snowy.show(snowy.hstack([gold, fast]))
+
+def test_mipmaps():
+    n = snowy.generate_noise(64, 48, frequency=4, seed=42)
+    levels = snowy.generate_mipmaps(n)
+    assert [level.shape[:2] for level in levels] == [
+        (48, 64), (24, 32), (12, 16), (6, 8), (3, 4), (1, 2), (1, 1)]
+    assert all(level.base is levels[0].base for level in levels)
+    assert np.allclose(levels[1], n.reshape(24, 2, 32, 2, 1).mean((1, 3)))
+    assert np.allclose(levels[-1], np.mean(n))
+    levels = snowy.generate_mipmaps(n, snowy.LANCZOS, wrapx=True)
+    snowy.show(snowy.hstack([snowy.resize(level, 64, 48, snowy.NEAREST)
+                             for level in levels[:4]]))
+
+def test_float32():
+    n = np.float32(snowy.generate_noise(64, 48, frequency=4, seed=42))
+    n = np.dstack([n, n, n, np.ones(n.shape, np.float32)])
+    assert snowy.resize(n, 32, 24).dtype == np.float32
+    assert snowy.blur(n, radius=2).dtype == np.float32
+    assert snowy.blur(n, snowy.FAST_GAUSSIAN).dtype == np.float32
+    assert snowy.generate_mipmaps(n)[-1].dtype == np.float32
+    assert snowy.rotate(n, 90).dtype == np.float32
+    assert snowy.hflip(n).dtype == np.float32
+    assert snowy.vflip(n).dtype == np.float32
+    assert snowy.add_border(n).dtype == np.float32
+    assert snowy.compose(n, n).dtype == np.float32
+    assert snowy.compose(snowy.extract_rgb(n), n).dtype == np.float32
+    a = snowy.resize(n, 32, 24)
+    b = snowy.resize(np.float64(n), 32, 24)
+    assert np.allclose(a, b, atol=1e-5)
+
+def test_out():
+    n = snowy.generate_noise(40, 30, frequency=4, seed=42)
+    n = np.dstack([n, 1 - n, n * n, 0.5 + 0.5 * n])
+    for fn in [snowy.hflip, snowy.vflip, lambda x, out=None:
+               snowy.rotate(x, 180, out=out)]:
+        gold = fn(n)
+        inplace = n.copy()
+        assert fn(inplace, out=inplace) is inplace
+        assert np.array_equal(gold, inplace)
+    square = n[:30,:30]
+    gold = snowy.rotate(square, 90)
+    inplace = square.copy()
+    snowy.rotate(inplace, 90, out=inplace)
+    assert np.array_equal(gold, inplace)
+    out = np.empty([20, 15, 4])
+    assert snowy.resize(n, out=out) is out
+    assert np.allclose(out, snowy.resize(n, 15, 20))
+    gold = snowy.blur(n, radius=3)
+    snowy.blur(n, radius=3, out=n)
+    assert np.allclose(gold, n)
+    gold = snowy.compose(n, n[::-1])
+    dst = n.copy()
+    snowy.compose(dst, n[::-1], out=dst)
+    assert np.allclose(gold, dst)
+    out = np.empty([34, 44, 4])
+    snowy.add_border(n, out=out)
+    assert np.array_equal(out, snowy.add_border(n))
+
+def test_stack():
+    a, b = np.zeros([10, 3, 1]), np.ones([10, 5, 1])
+    gold = np.hstack([snowy.add_border(a, 2, .5, 'LTB'),
+                      snowy.add_border(b, 2, .5)])
+    assert np.array_equal(snowy.hstack([a, b], 2, .5), gold)
+    out = np.empty([12, 14, 1])
+    c = np.ones([3, 10, 1])
+    snowy.vstack([np.swapaxes(a, 0, 1), c], 2, .5, out=out)
+    gold = np.vstack([snowy.add_border(np.swapaxes(a, 0, 1), 2, .5, 'LTR'),
+                      snowy.add_border(c, 2, .5)])
+    assert np.array_equal(out, gold)
+
+def test_compose_offset():
+    canvas = np.zeros([40, 60, 4])
+    sprite = np.dstack([np.ones([10, 10, 3]), np.full([10, 10, 1], 0.5)])
+    result = snowy.compose(canvas, sprite, offset=(55, -5))
+    assert np.array_equal(result[:5, 55:], 0.5 * sprite[5:, :5])
+    result[:5, 55:] = 0
+    assert not np.any(result)
+    rgb = canvas[:,:,:3].copy()
+    snowy.compose(rgb, sprite, out=rgb, offset=(10, 20))
+    assert np.array_equal(rgb[20:30, 10:20], np.full([10, 10, 3], 0.5))
+    assert np.sum(rgb) == 150
+
+def test_compose_many():
+    rnd = np.random.RandomState(42)
+    canvas = rnd.rand(50, 70, 3)
+    layers = [rnd.rand(20, 30, 4), rnd.rand(50, 70, 3), rnd.rand(8, 9, 4)]
+    offsets = [(5, 10), (0, 0), (65, 45)]
+    gold = canvas
+    for layer, offset in zip(layers[::2], offsets[::2]):
+        gold = snowy.compose(gold, layer, offset=offset)
+    result = snowy.compose_many(canvas, layers[::2], offsets[::2])
+    assert np.allclose(gold, result)
+    # The opaque second layer hides the first layer, but not the third.
+    result = snowy.compose_many(canvas, layers, offsets)
+    assert np.allclose(result[0, 0], layers[1][0, 0])
+    assert np.allclose(result[15, 10], layers[1][15, 10])
+    gold = snowy.compose(layers[1], layers[2], offset=offsets[2])
+    assert np.allclose(result, gold)
+    gold = snowy.compose_premultiplied(canvas, layers[0])
+    snowy.compose_many(canvas, layers[:1], premultiplied=True, out=canvas)
+    assert np.allclose(gold, canvas)